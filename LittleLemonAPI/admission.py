@@ -0,0 +1,169 @@
+import heapq
+import itertools
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from . import metrics
+
+
+class PriorityClass:
+    def __init__(self, name, priority, limit, timeout, methods=None, paths=None, anonymous=None,
+                 reserve=0):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.timeout = timeout
+        # slots only this class and higher priority ones may use
+        self.reserve = reserve
+        self.methods = set(methods) if methods else None
+        self.paths = [re.compile(path) for path in paths] if paths else None
+        self.anonymous = anonymous
+
+    def matches(self, method, path, anonymous):
+        if self.methods is not None and method not in self.methods:
+            return False
+        if self.paths is not None and not any(p.match(path) for p in self.paths):
+            return False
+        return self.anonymous is None or self.anonymous == anonymous
+
+
+class AdmissionController:
+    # At most `max_concurrent` requests run at once, and at most `limit` of
+    # each class. A request that can't start waits in a queue ordered by
+    # priority (lower first), then arrival, until its class timeout runs out;
+    # then it is shed. The slots reserved for higher priority classes are
+    # never given to a lower one, so checkout still gets in while everything
+    # else is saturated.
+    def __init__(self, max_concurrent, classes, default, exempt=()):
+        self.max_concurrent = max_concurrent
+        self.classes = classes
+        self.default = default
+        self.exempt = [re.compile(path) for path in exempt]
+        self.usable = {cls.name: max_concurrent - sum(other.reserve for other in classes + [default]
+                                                      if other.priority < cls.priority)
+                       for cls in classes + [default]}
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.stats = {cls.name: {'active': 0, 'queued': 0, 'admitted': 0, 'shed': 0}
+                      for cls in classes + [default]}
+
+    def is_exempt(self, path):
+        return any(p.match(path) for p in self.exempt)
+
+    def classify(self, method, path, anonymous):
+        for cls in self.classes:
+            if cls.matches(method, path, anonymous):
+                return cls
+        return self.default
+
+    def can_run(self, cls):
+        return self.active < self.usable[cls.name] and \
+            self.stats[cls.name]['active'] < cls.limit
+
+    def first_in_line(self, ticket):
+        # nothing queued ahead of this ticket could run right now
+        return not any(other < ticket and self.can_run(other[2])
+                       for other in self.waiting)
+
+    def admit(self, cls):
+        self.active += 1
+        self.stats[cls.name]['active'] += 1
+        self.stats[cls.name]['admitted'] += 1
+
+    def acquire(self, cls):
+        with self.condition:
+            ticket = (cls.priority, next(self.sequence), cls)
+            if self.can_run(cls) and self.first_in_line(ticket):
+                self.admit(cls)
+                return True
+
+            deadline = time.monotonic() + cls.timeout
+            heapq.heappush(self.waiting, ticket)
+            self.stats[cls.name]['queued'] += 1
+            try:
+                while True:
+                    if self.can_run(cls) and self.first_in_line(ticket):
+                        self.admit(cls)
+                        return True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats[cls.name]['shed'] += 1
+                        metrics.inc('shed_requests_total', (('class', cls.name),))
+                        return False
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.stats[cls.name]['queued'] -= 1
+                # whoever is next may be able to go now that this ticket left
+                self.condition.notify_all()
+
+    def release(self, cls):
+        with self.condition:
+            self.active -= 1
+            self.stats[cls.name]['active'] -= 1
+            self.condition.notify_all()
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                'active': self.active,
+                'max_concurrent': self.max_concurrent,
+                'classes': {name: dict(counts) for name, counts in self.stats.items()},
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                conf = settings.ADMISSION_CONTROL
+                _controller = AdmissionController(
+                    conf['MAX_CONCURRENT'],
+                    [PriorityClass(**cls) for cls in conf['CLASSES']],
+                    PriorityClass(**conf['DEFAULT']),
+                    conf.get('EXEMPT', ()))
+    return _controller
+
+
+class AdmissionControlMiddleware:
+    # Queues and sheds requests by priority class so that checkout keeps
+    # working when browsing traffic spikes. The limits are per process, so
+    # they only come into play with threaded workers (e.g. gunicorn gthread).
+    # Whether a request is anonymous is only guessed from the Authorization
+    # header and session cookie, so a client can send a made-up header to get
+    # out of the browse class; it then competes in the default class.
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.ADMISSION_CONTROL['ENABLED']:
+            return self.get_response(request)
+
+        controller = get_controller()
+        if controller.is_exempt(request.path_info):
+            return self.get_response(request)
+        # decided from the request alone, without loading the session or user
+        anonymous = 'HTTP_AUTHORIZATION' not in request.META and \
+            settings.SESSION_COOKIE_NAME not in request.COOKIES
+        cls = controller.classify(request.method, request.path_info, anonymous)
+        if not controller.acquire(cls):
+            response = JsonResponse(
+                {"message": "The server is busy, please try again shortly"}, status=503)
+            response['Retry-After'] = str(settings.ADMISSION_CONTROL['RETRY_AFTER'])
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            controller.release(cls)
@@ -0,0 +1,85 @@
+from datetime import timedelta
+from heapq import merge
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, Value
+from django.utils import timezone
+
+from .models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+from .routers import fan_out, location_databases
+from . import summary
+
+ORDER_FIELDS = ['id', 'user_id', 'delivery_crew_id',
+                'status', 'total', 'date', 'location']
+ORDER_ITEM_FIELDS = ['id', 'order_id', 'menuitem_id',
+                     'quantity', 'unit_price', 'price', 'location']
+
+
+def archive_cutoff(days=None):
+    if days is None:
+        days = settings.ORDER_ARCHIVE_AFTER_DAYS
+    return timezone.localdate() - timedelta(days=days)
+
+
+def archivable_orders(cutoff, using):
+    # only delivered orders are moved, undelivered ones stay live however old
+    return Order.objects.using(using).filter(status=True, date__lt=cutoff).order_by('id')
+
+
+def archive_batch(cutoff, batch_size, using):
+    # Moves one chunk of orders of one location database in a single
+    # transaction, so an interrupted run leaves every order either fully live
+    # or fully archived. Returns the number of orders moved; 0 means there is
+    # nothing left to do.
+    with transaction.atomic(using=using):
+        orders = list(archivable_orders(cutoff, using).select_for_update()
+                      .values(*ORDER_FIELDS)[:batch_size])
+        if not orders:
+            return 0
+        ArchivedOrder.objects.using(using).bulk_create(
+            [ArchivedOrder(**order) for order in orders])
+        order_ids = [order['id'] for order in orders]
+        items = list(OrderItem.objects.using(using).filter(
+            order_id__in=order_ids).values(*ORDER_ITEM_FIELDS))
+        ArchivedOrderItem.objects.using(using).bulk_create(
+            [ArchivedOrderItem(**item) for item in items])
+        # the orders only move, the customers' order summaries stay as they are
+        with summary.paused():
+            Order.objects.using(using).filter(pk__in=order_ids).delete()
+    return len(orders)
+
+
+def archive_orders(days=None, batch_size=None, max_batches=None):
+    # Safe to stop and re-run at any point: every batch commits on its own and
+    # the next run simply picks up the orders that are still live.
+    cutoff = archive_cutoff(days)
+    if batch_size is None:
+        batch_size = settings.ORDER_ARCHIVE_BATCH_SIZE
+    archived = 0
+    for using in location_databases():
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            moved = archive_batch(cutoff, batch_size, using)
+            if not moved:
+                break
+            archived += moved
+            batches += 1
+    return archived
+
+
+def location_history(using, filters):
+    live = Order.objects.using(using).filter(**filters).values(
+        *ORDER_FIELDS, archived=Value(False, output_field=BooleanField()))
+    archived = ArchivedOrder.objects.using(using).filter(**filters).values(
+        *ORDER_FIELDS, archived=Value(True, output_field=BooleanField()))
+    return list(live.union(archived, all=True).order_by('-date', '-id'))
+
+
+def order_history(**filters):
+    # Live and archived orders of every location as one list of dicts, newest
+    # first, for manager reports. Each location database is queried at the
+    # same time. The request path never calls this, it only reads the live
+    # Order table.
+    histories = fan_out(lambda using: location_history(using, filters))
+    return list(merge(*histories, key=lambda row: (row['date'], row['id']), reverse=True))
@@ -0,0 +1,147 @@
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+
+from .permissions import in_group
+from .routers import HEADER, current_location, use_location
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# headers of the batch request that must not be applied to every sub-request
+NOT_INHERITED = ('HTTP_IDEMPOTENCY_KEY', 'HTTP_X_PROFILE', 'CONTENT_TYPE', 'CONTENT_LENGTH')
+
+
+class BatchError(Exception):
+    pass
+
+
+def parse_batch(data):
+    # {"requests": [{"method": "GET", "path": "/api/menu-items/?page=2"},
+    #               {"method": "POST", "path": "/api/cart/menu-items/", "body": {...}}],
+    #  "parallel": true}
+    sub_requests = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(sub_requests, list) or not sub_requests:
+        raise BatchError("requests must be a non-empty list")
+    if len(sub_requests) > settings.BATCH['MAX_REQUESTS']:
+        raise BatchError(
+            f"A batch can have at most {settings.BATCH['MAX_REQUESTS']} requests")
+    for spec in sub_requests:
+        if not isinstance(spec, dict) or not isinstance(spec.get('path'), str):
+            raise BatchError("every request needs a path")
+        if not isinstance(spec.get('headers', {}), dict):
+            raise BatchError("headers must be an object")
+    return sub_requests, bool(data.get('parallel'))
+
+
+def build_request(request, spec, match):
+    # A plain HttpRequest standing in for the sub-request. It carries the
+    # batch request's user so the API views skip authentication.
+    parent = request._request
+    url = urlsplit(spec['path'])
+    sub = HttpRequest()
+    sub.method = str(spec.get('method', 'GET')).upper()
+    sub.path = sub.path_info = url.path
+    sub.META = {key: value for key, value in parent.META.items()
+                if key not in NOT_INHERITED}
+    sub.META.update({
+        'REQUEST_METHOD': sub.method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'HTTP_ACCEPT': 'application/json',
+    })
+    for name, value in spec.get('headers', {}).items():
+        sub.META['HTTP_' + name.upper().replace('-', '_')] = str(value)
+    sub.GET = QueryDict(url.query)
+    sub.COOKIES = parent.COOKIES
+    if hasattr(parent, 'session'):
+        sub.session = parent.session
+
+    body = json.dumps(spec['body']).encode() if 'body' in spec else b''
+    sub.META['CONTENT_TYPE'] = 'application/json'
+    sub.META['CONTENT_LENGTH'] = str(len(body))
+    sub._stream = io.BytesIO(body)
+    sub._read_started = False
+
+    sub.user = request.user
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    sub.resolver_match = match
+    return sub
+
+
+def run(request, spec):
+    path = urlsplit(spec['path']).path
+    if not path.startswith('/api/'):
+        return {'status': 400, 'body': {"message": "Only api/ requests can be batched"}}
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return {'status': 404, 'body': {"message": "Not found"}}
+    if match.route == request.resolver_match.route:
+        return {'status': 400, 'body': {"message": "Batches cannot be nested"}}
+
+    sub = build_request(request, spec, match)
+    # a sub-request can name its own location, otherwise it has the batch's
+    location = sub.headers.get(HEADER) or sub.GET.get('location') or current_location()
+    if location not in settings.LOCATIONS:
+        return {'status': 400, 'body': {"message": f"Unknown location {location}"}}
+    try:
+        with use_location(location):
+            response = match.func(sub, *match.args, **match.kwargs)
+    except Exception:
+        logger.exception("Batched request %s %s failed", spec.get('method', 'GET'), path)
+        return {'status': 500, 'body': {"message": "Server error"}}
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    content = response.content
+    if response.get('Content-Type', '').startswith('application/json'):
+        body = json.loads(content) if content else None
+    else:
+        body = content.decode(response.charset or 'utf-8')
+    headers = {name: value for name, value in response.items()
+               if name not in ('Content-Type', 'Content-Length')}
+    return {'status': response.status_code, 'headers': headers, 'body': body}
+
+
+def run_in_thread(request, spec, location):
+    try:
+        with use_location(location):
+            return run(request, spec)
+    finally:
+        # each pool thread has its own database connections
+        connections.close_all()
+
+
+def run_batch(request, sub_requests, parallel):
+    # Sub-requests run in order. With parallel, consecutive read requests are
+    # run together on a thread pool; writes always run one at a time.
+    # Load the user's groups once for every sub-request (and every thread).
+    in_group(request.user, 'Manager')
+    responses = [None] * len(sub_requests)
+    if not parallel:
+        for i, spec in enumerate(sub_requests):
+            responses[i] = run(request, spec)
+        return responses
+
+    with ThreadPoolExecutor(max_workers=settings.BATCH['MAX_WORKERS']) as pool:
+        reads = []
+        for i, spec in enumerate(sub_requests + [None]):
+            if spec is not None and str(spec.get('method', 'GET')).upper() in SAFE_METHODS:
+                reads.append(i)
+                continue
+            futures = {j: pool.submit(run_in_thread, request, sub_requests[j], current_location())
+                       for j in reads}
+            for j, future in futures.items():
+                responses[j] = future.result()
+            reads = []
+            if spec is not None:
+                responses[i] = run(request, spec)
+    return responses
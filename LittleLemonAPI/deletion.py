@@ -0,0 +1,234 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import summary
+from .models import (MenuItem, Cart, Order, OrderItem, ArchivedOrder, ArchivedOrderItem,
+                     IdempotencyKey, DeletionJob, CustomerOrderSummary)
+from .routers import is_sharded, location_databases
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    # the job was taken over by another process after this one stalled
+    pass
+
+
+def table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def column(model, name):
+    return connection.ops.quote_name(model._meta.get_field(name).column)
+
+
+def where_equal(model, name):
+    return f"{column(model, name)} = %s"
+
+
+def where_in_orders(item_model, order_model):
+    # items of the orders placed by the user
+    return (f"{column(item_model, 'order')} IN (SELECT {column(order_model, 'id')} "
+            f"FROM {table(order_model)} WHERE {where_equal(order_model, 'user')})")
+
+
+def steps(kind):
+    # (model, rows to remove, column to clear instead of deleting the row),
+    # children before parents so no step leaves rows pointing at deleted ones
+    if kind == DeletionJob.MENU_ITEM:
+        return [
+            (Cart, where_equal(Cart, 'menuitem'), None),
+            (OrderItem, where_equal(OrderItem, 'menuitem'), None),
+            (ArchivedOrderItem, where_equal(ArchivedOrderItem, 'menuitem'), None),
+        ]
+    return [
+        (Cart, where_equal(Cart, 'user'), None),
+        (IdempotencyKey, where_equal(IdempotencyKey, 'user'), None),
+        (OrderItem, where_in_orders(OrderItem, Order), None),
+        (OrderItem, where_equal(OrderItem, 'customer'), None),
+        (Order, where_equal(Order, 'user'), None),
+        (ArchivedOrderItem, where_in_orders(ArchivedOrderItem, ArchivedOrder), None),
+        (ArchivedOrderItem, where_equal(ArchivedOrderItem, 'customer'), None),
+        (ArchivedOrder, where_equal(ArchivedOrder, 'user'), None),
+        (Order, where_equal(Order, 'delivery_crew'), 'delivery_crew'),
+        (ArchivedOrder, where_equal(ArchivedOrder, 'delivery_crew'), 'delivery_crew'),
+    ]
+
+
+def run_step(job, model, where, null_column, batch_size, using):
+    # One set-based statement per batch, each in its own short transaction so
+    # the write lock is never held for long and other requests get in between
+    pk = column(model, 'id')
+    selected = f"SELECT {pk} FROM {table(model)} WHERE {where} LIMIT %s"
+    if null_column is None:
+        sql = f"DELETE FROM {table(model)} WHERE {pk} IN ({selected})"
+        progress_key = model._meta.db_table
+    else:
+        sql = f"UPDATE {table(model)} SET {column(model, null_column)} = NULL WHERE {pk} IN ({selected})"
+        progress_key = f"{model._meta.db_table}.{null_column}"
+    while True:
+        with transaction.atomic(), transaction.atomic(using=using):
+            with connections[using].cursor() as cursor:
+                cursor.execute(sql, [job.object_id, batch_size])
+                count = cursor.rowcount
+            job.deleted[progress_key] = job.deleted.get(progress_key, 0) + count
+            renew(job, deleted=job.deleted)
+        if count < batch_size:
+            return
+        time.sleep(settings.DELETION['PAUSE'])
+
+
+def run_job(job):
+    batch_size = settings.DELETION['BATCH_SIZE']
+    try:
+        for model, where, null_column in steps(job.kind):
+            # carts and orders are in every location's database
+            databases = location_databases() if is_sharded(model) else [DEFAULT_DB_ALIAS]
+            for using in databases:
+                run_step(job, model, where, null_column, batch_size, using)
+        # only a handful of rows (tokens, group memberships...) can be left,
+        # so the regular cascade is cheap now. It takes the customers' tallies
+        # of a menu item, or a user's summary, with it.
+        if job.kind == DeletionJob.MENU_ITEM:
+            MenuItem.objects.filter(pk=job.object_id).delete()
+            forget_favorite(job.object_id)
+        else:
+            User.objects.filter(pk=job.object_id).delete()
+    except LeaseLost:
+        raise
+    except Exception as exc:
+        renew(job, status=DeletionJob.FAILED, error=str(exc))
+        raise
+    renew(job, status=DeletionJob.DONE)
+
+
+def forget_favorite(menuitem_id):
+    # The order items were deleted with plain SQL, which the summaries don't
+    # see, so customers who had the menu item among their favorites get them
+    # worked out again from the remaining tallies
+    for user_id, items in CustomerOrderSummary.objects.values_list('user_id', 'favorite_items').iterator():
+        if any(item['menuitem'] == menuitem_id for item in items):
+            summary.refresh_favorites(user_id)
+
+
+def lease_cutoff():
+    # a running job whose `updated` is older than this was abandoned
+    return timezone.now() - timedelta(seconds=settings.DELETION['LEASE'])
+
+
+def claimable():
+    # pending jobs, and running ones whose process stopped renewing the lease
+    # (it died, or hangs); every batch renews it
+    return DeletionJob.objects.filter(
+        Q(status=DeletionJob.PENDING) | Q(status=DeletionJob.RUNNING, updated__lt=lease_cutoff()))
+
+
+def claim(job):
+    # several processes may run jobs; only one of them gets each job, since
+    # the update only matches the row as it was read
+    now = timezone.now()
+    claimed = DeletionJob.objects.filter(
+        pk=job.pk, status=job.status, updated=job.updated).update(
+        status=DeletionJob.RUNNING, updated=now) == 1
+    if claimed:
+        job.status = DeletionJob.RUNNING
+        job.updated = now
+    return claimed
+
+
+def renew(job, **changes):
+    # saves the job's progress and extends the lease, as long as no other
+    # process has taken the job over in the meantime
+    now = timezone.now()
+    if not DeletionJob.objects.filter(
+            pk=job.pk, status=DeletionJob.RUNNING, updated=job.updated).update(updated=now, **changes):
+        raise LeaseLost()
+    job.updated = now
+    for name, value in changes.items():
+        setattr(job, name, value)
+
+
+def process_jobs():
+    done = 0
+    while True:
+        job = claimable().order_by('id').first()
+        if job is None:
+            return done
+        if claim(job):
+            try:
+                run_job(job)
+            except LeaseLost:
+                logger.warning("Deletion job %s was taken over by another process", job.pk)
+            except Exception:
+                logger.exception("Deletion job %s failed", job.pk)
+            done += 1
+
+
+_worker = None
+_worker_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def worker():
+    global _worker
+    try:
+        while True:
+            _wake.clear()
+            process_jobs()
+            # jobs running in other processes are taken over when their lease
+            # runs out, so keep an eye on them until they are finished
+            running = DeletionJob.objects.filter(status=DeletionJob.RUNNING).exists()
+            with _worker_lock:
+                # stop unless a job was scheduled while this pass was running
+                if not running and not _wake.is_set():
+                    _worker = None
+                    return
+            _wake.wait(settings.DELETION['LEASE'])
+    finally:
+        with _worker_lock:
+            if _worker is threading.current_thread():
+                _worker = None
+        connections.close_all()
+
+
+def start_worker():
+    # one background thread per process works through the pending jobs
+    global _worker
+    if not settings.DELETION['BACKGROUND']:
+        return
+    with _worker_lock:
+        _wake.set()
+        if _worker is None:
+            _worker = threading.Thread(
+                target=worker, name='deletion-worker', daemon=True)
+            _worker.start()
+
+
+def schedule(kind, object_id):
+    job = DeletionJob.objects.create(kind=kind, object_id=object_id)
+    transaction.on_commit(start_worker)
+    return job
+
+
+def delete_menu_item(item):
+    # hidden from the menu at once, removed for good by the worker
+    with transaction.atomic():
+        item.available = False
+        item.save(update_fields=['available'])
+        return schedule(DeletionJob.MENU_ITEM, item.pk)
+
+
+def delete_user(user):
+    # can't log in any more at once, removed for good by the worker
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        return schedule(DeletionJob.USER, user.pk)
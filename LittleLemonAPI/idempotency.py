@@ -0,0 +1,102 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import metrics
+from .models import IdempotencyKey
+from .routers import current_location
+
+HEADER = 'Idempotency-Key'
+CACHE_HIT = (('cache', 'idempotency_key'), ('result', 'hit'))
+CACHE_MISS = (('cache', 'idempotency_key'), ('result', 'miss'))
+
+
+def request_fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, default=str)
+    digest = hashlib.sha256()
+    # the same cart or order payload sent to another location is another request
+    for part in (request.method, request.path, current_location(), payload):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def replay(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return Response({"message": f"{HEADER} was already used for a different request"},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if record.status_code is None:
+        return Response({"message": f"A request with this {HEADER} is still being processed"},
+                        status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+    return Response(record.response, status=record.status_code,
+                    headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(view_method):
+    # Wraps a view's post() so that a retry carrying the same Idempotency-Key
+    # gets the stored response back without running validation or writes again.
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({"message": f"{HEADER} must be at most 255 characters"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user
+        fingerprint = request_fingerprint(request)
+        now = timezone.now()
+        record = IdempotencyKey.objects.filter(
+            user=user, key=key, expires__gt=now).first()
+        if record is not None:
+            metrics.inc('cache_requests_total', CACHE_HIT)
+            return replay(record, fingerprint)
+        metrics.inc('cache_requests_total', CACHE_MISS)
+
+        # claim the key before doing any work; the unique (user, key) index
+        # makes sure only one of several concurrent duplicates gets through.
+        # The claim only lasts IDEMPOTENCY_KEY_PROCESSING seconds, so a claim
+        # left behind by a worker that was killed mid-request expires soon
+        # and is removed here like any other expired key.
+        IdempotencyKey.objects.filter(
+            user=user, key=key, expires__lte=now).delete()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=user, key=key, fingerprint=fingerprint,
+                    expires=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_PROCESSING))
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if record is None:
+                return Response({"message": f"A request with this {HEADER} is still being processed"},
+                                status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+            return replay(record, fingerprint)
+
+        # only this claim is touched below; when it expired while the view ran
+        # and a retry took the key over, the retry's record is left alone
+        claim = IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True)
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            claim.delete()
+            raise
+        if response.status_code >= 500:
+            # let the client retry server errors for real
+            claim.delete()
+        else:
+            claim.update(status_code=response.status_code, response=response.data,
+                         expires=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL))
+        return response
+    return wrapper
+
+
+def purge_expired_keys():
+    return IdempotencyKey.objects.filter(expires__lte=timezone.now()).delete()[0]
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = "Move delivered orders older than --days, with their items, into the archive tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Age in days after which delivered orders are archived (default: ORDER_ARCHIVE_AFTER_DAYS)")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Orders moved per transaction (default: ORDER_ARCHIVE_BATCH_SIZE)")
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help="Stop after this many batches; run again later to resume")
+
+    def handle(self, *args, **options):
+        archived = archive_orders(
+            days=options['days'], batch_size=options['batch_size'], max_batches=options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} order(s)"))
@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from LittleLemonAPI import summary
+from LittleLemonAPI.models import Order, OrderItem
+
+# the writers are forked, so they start with Django set up and the scratch
+# databases registered
+context = multiprocessing.get_context('fork')
+
+
+def place_orders(using, count, items, ready):
+    # one writer process, one transaction per order like a checkout; the
+    # scratch orders are left out of the customers' summaries
+    try:
+        connections[using].ensure_connection()
+        ready.wait()
+    except BaseException:
+        # don't leave the others waiting for this one
+        ready.abort()
+        raise
+    try:
+        with summary.paused():
+            for _ in range(count):
+                with transaction.atomic(using=using):
+                    order = Order(user_id=1, total=Decimal('10.00'), date=timezone.localdate())
+                    order.save(using=using)
+                    OrderItem.objects.using(using).bulk_create([
+                        OrderItem(order=order, menuitem_id=menuitem_id, quantity=1,
+                                  unit_price=Decimal('5.00'), price=Decimal('5.00'))
+                        for menuitem_id in range(1, items + 1)])
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ("Measure order write throughput with one writer process per location database, "
+            "against as many writer processes sharing a single database. Writes to scratch "
+            "SQLite databases in a temporary directory, never to the configured ones")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4,
+                            help="Measure with 1 up to this many writers and databases (default: 4)")
+        parser.add_argument('--orders', type=int, default=500,
+                            help="Orders placed by every writer (default: 500)")
+        parser.add_argument('--items', type=int, default=2,
+                            help="Items in every order (default: 2)")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(prefix='benchmark_shards-') as directory:
+            # the location tables are created once and copied for every database
+            template = self.add_database('benchmark_template', os.path.join(directory, 'template.sqlite3'))
+            call_command('migrate', database=template, verbosity=0)
+            connections[template].close()
+
+            self.stdout.write(f"{'writers':>8} {'one database':>16} {'own databases':>16}")
+            for writers in range(1, options['writers'] + 1):
+                shared = self.measure(directory, writers, 1, options)
+                spread = self.measure(directory, writers, writers, options)
+                self.stdout.write(f"{writers:>8} {shared:>10.0f} ord/s {spread:>10.0f} ord/s")
+
+    def add_database(self, alias, path):
+        connections.databases[alias] = {
+            **connections.databases[DEFAULT_DB_ALIAS],
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': path,
+        }
+        return alias
+
+    def measure(self, directory, writers, databases, options):
+        # fresh copies of the template, the writers take turns between them
+        aliases = []
+        for number in range(databases):
+            path = os.path.join(directory, f'location_{number}.sqlite3')
+            shutil.copyfile(os.path.join(directory, 'template.sqlite3'), path)
+            aliases.append(self.add_database(f'benchmark_{number}', path))
+        connections.close_all()
+
+        ready = context.Barrier(writers + 1)
+        processes = [context.Process(target=place_orders, args=(
+            aliases[number % databases], options['orders'], options['items'], ready))
+            for number in range(writers)]
+        for process in processes:
+            process.start()
+        # the clock starts once every writer is connected
+        try:
+            ready.wait()
+        except threading.BrokenBarrierError:
+            pass
+        start = time.perf_counter()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        if ready.broken or any(process.exitcode for process in processes):
+            raise CommandError("A writer process failed, see its traceback above")
+        return writers * options['orders'] / elapsed
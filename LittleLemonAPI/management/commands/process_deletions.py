@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.deletion import process_jobs
+
+
+class Command(BaseCommand):
+    help = ("Remove the carts, orders and order items of deleted menu items and users, "
+            "including jobs left running by a worker that stopped")
+
+    def handle(self, *args, **options):
+        done = process_jobs()
+        self.stdout.write(self.style.SUCCESS(f"Processed {done} deletion job(s)"))
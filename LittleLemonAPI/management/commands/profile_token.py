@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.profiling import profile_token
+
+
+class Command(BaseCommand):
+    help = "Print a signed value for the X-Profile header that turns on profiling for a request"
+
+    def handle(self, *args, **options):
+        self.stdout.write(profile_token())
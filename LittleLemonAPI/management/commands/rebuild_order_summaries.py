@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.summary import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the customers' order summaries from their orders at every location"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only count the customers whose summary or item tallies are out of date, without changing them")
+
+    def handle(self, *args, **options):
+        wrong = rebuild(check=options['check'])
+        if options['check']:
+            self.stdout.write(f"{wrong} order summary(ies) out of date")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt the order summaries, {wrong} were out of date"))
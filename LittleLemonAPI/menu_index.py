@@ -0,0 +1,168 @@
+import threading
+import time
+import uuid
+from bisect import bisect_right
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+from .models import MenuItem
+
+# Fields MenuItemsViewSet can be ordered by, see MenuItemsViewSet.ordering_fields
+ORDERING_FIELDS = ('price', 'category')
+VERSION_KEY = 'LittleLemonAPI.menu_index.version'
+CACHE_HIT = (('cache', 'menu_index'), ('result', 'hit'))
+CACHE_MISS = (('cache', 'menu_index'), ('result', 'miss'))
+
+# SQLite's LIKE (which icontains uses) only folds ASCII letters, so search
+# matching here does the same
+ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+                            'abcdefghijklmnopqrstuvwxyz')
+
+
+def ascii_lower(value):
+    return value.translate(ASCII_LOWER)
+
+
+def trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class MenuRow:
+    __slots__ = ('id', 'price', 'category_id', 'category_title', 'text', 'data')
+
+    def __init__(self, item):
+        self.id = item.id
+        self.price = item.price
+        self.category_id = item.category_id
+        self.category_title = item.category.title
+        # what ?search= is matched against: the title and the category title.
+        # Search terms can't contain a NUL so a match never spans both.
+        self.text = ascii_lower(f"{item.title}\0{item.category.title}")
+        # the serialized item, built once instead of on every request.
+        # Imported here since the serializers query the categories when they
+        # are loaded, and this module is loaded from AppConfig.ready()
+        from .serializers import MenuItemSerializer
+        self.data = MenuItemSerializer(item).data
+
+
+class MenuIndex:
+    # An immutable snapshot of the menu that answers the list queries of
+    # MenuItemsViewSet in memory, returning the same rows in the same order
+    # as the filter backends would from the database. A new snapshot is built
+    # whenever a MenuItem or Category changes and replaces the old one whole.
+    def __init__(self, items, version):
+        self.version = version
+        self.built = time.monotonic()
+        self.rows = tuple(MenuRow(item) for item in items)
+        positions = range(len(self.rows))
+
+        self.categories = {}
+        for position in positions:
+            self.categories.setdefault(
+                self.rows[position].category_title, []).append(position)
+        self.categories = {title: tuple(found)
+                           for title, found in self.categories.items()}
+
+        # positions ordered by price, for ?to_price= lookups with bisect
+        self.by_price = tuple(sorted(
+            positions, key=lambda p: (self.rows[p].price, self.rows[p].id)))
+        self.sorted_prices = tuple(self.rows[p].price for p in self.by_price)
+
+        # dense rank of every row per ordering field, and the full order for
+        # each single field ordering, ties broken by id like the SQL path
+        self.ranks = {}
+        self.orderings = {}
+        for field in ORDERING_FIELDS:
+            attribute = 'category_id' if field == 'category' else field
+            values = sorted({getattr(row, attribute) for row in self.rows})
+            rank_of = {value: rank for rank, value in enumerate(values)}
+            ranks = tuple(rank_of[getattr(row, attribute)] for row in self.rows)
+            self.ranks[field] = ranks
+            self.orderings[field] = tuple(sorted(
+                positions, key=lambda p: (ranks[p], self.rows[p].id)))
+            self.orderings['-' + field] = tuple(sorted(
+                positions, key=lambda p: (-ranks[p], self.rows[p].id)))
+
+        self.trigrams = {}
+        for position, row in enumerate(self.rows):
+            for trigram in trigrams(row.text):
+                self.trigrams.setdefault(trigram, set()).add(position)
+        self.trigrams = {trigram: frozenset(found)
+                         for trigram, found in self.trigrams.items()}
+
+    def search(self, term):
+        # the trigram index narrows the candidates; terms shorter than three
+        # characters have no trigrams and are checked against every row
+        term = ascii_lower(term)
+        candidates = range(len(self.rows))
+        if len(term) >= 3:
+            found = None
+            for trigram in trigrams(term):
+                matches = self.trigrams.get(trigram, frozenset())
+                found = matches if found is None else found & matches
+                if not found:
+                    return set()
+            candidates = found
+        return {p for p in candidates if term in self.rows[p].text}
+
+    def query(self, category=None, to_price=None, search_terms=(), ordering=()):
+        selected = None
+        if category:
+            selected = set(self.categories.get(category, ()))
+        if to_price is not None:
+            below = set(self.by_price[:bisect_right(self.sorted_prices, to_price)])
+            selected = below if selected is None else selected & below
+        for term in search_terms:
+            matches = self.search(term)
+            selected = matches if selected is None else selected & matches
+
+        ordering = list(ordering or ())
+        if len(ordering) == 1:
+            order = self.orderings[ordering[0]]
+        elif ordering:
+            keys = [(self.ranks[term.lstrip('-')], -1 if term.startswith('-') else 1)
+                    for term in ordering]
+            candidates = range(len(self.rows)) if selected is None else selected
+            order = sorted(candidates, key=lambda p: tuple(
+                sign * ranks[p] for ranks, sign in keys) + (self.rows[p].id,))
+        else:
+            # rows are kept in id order
+            order = range(len(self.rows))
+
+        if selected is None:
+            return [self.rows[p] for p in order]
+        return [self.rows[p] for p in order if p in selected]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    # The version in the shared MENU_INDEX['CACHE'] tells every worker process
+    # that the menu changed; MAX_AGE is only a safety net.
+    global _index
+    version = caches[settings.MENU_INDEX['CACHE']].get(VERSION_KEY)
+    index = _index
+    if index is not None and index.version == version and \
+            time.monotonic() - index.built < settings.MENU_INDEX['MAX_AGE']:
+        metrics.inc('cache_requests_total', CACHE_HIT)
+        return index
+    metrics.inc('cache_requests_total', CACHE_MISS)
+    with _lock:
+        index = _index
+        if index is None or index.version != version or \
+                time.monotonic() - index.built >= settings.MENU_INDEX['MAX_AGE']:
+            items = MenuItem.objects.filter(available=True).select_related(
+                'category').order_by('id')
+            index = MenuIndex(items, version)
+            _index = index
+    return index
+
+
+def invalidate():
+    global _index
+    caches[settings.MENU_INDEX['CACHE']].set(VERSION_KEY, uuid.uuid4().hex, None)
+    _index = None
@@ -0,0 +1,257 @@
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'http_request_duration_seconds': (
+        'histogram', "Time spent handling a request, by route and method",
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    'db_queries_per_request': (
+        'histogram', "Database queries run by a request, by route",
+        (0, 1, 2, 3, 5, 10, 20, 50, 100)),
+    'db_query_duration_seconds': (
+        'histogram', "Time spent in a single database query",
+        (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)),
+    'throttled_requests_total': (
+        'counter', "Requests rejected by a throttle, by route", None),
+    'shed_requests_total': (
+        'counter', "Requests turned away by admission control, by priority class", None),
+    'cache_requests_total': (
+        'counter', "Cache lookups, by cache and hit or miss", None),
+    'group_checks_total': (
+        'counter', "Role checks against a user's groups, by group", None),
+}
+
+# Values recorded by this process since it started. Histograms keep one count
+# per bucket (not cumulative, the last one is +Inf) followed by the sum.
+_counters = {}
+_histograms = {}
+_lock = threading.Lock()
+# when the next request writes this process's values to its file
+_next_flush = 0
+# One file per worker process, written from requests only (so management
+# commands leave nothing behind). When a worker has exited its values are added
+# to MERGED, so they keep counting without the files piling up.
+_file_name = f"metrics-{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+MERGED = 'metrics-merged.json'
+
+
+def _forked():
+    # a worker forked from a process that already loaded the app (gunicorn
+    # --preload) starts with values and a file of its own
+    global _file_name, _lock
+    _file_name = f"metrics-{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+
+
+os.register_at_fork(after_in_child=_forked)
+
+
+def inc(name, labels=(), amount=1):
+    key = (name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, labels, value):
+    buckets = METRICS[name][2]
+    key = (name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(buckets) + 2)
+        histogram[bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+
+def write(path, counters, histograms):
+    data = {
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'histograms': [[name, labels, list(values)] for (name, labels), values in histograms.items()],
+    }
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+
+def flush():
+    global _next_flush
+    directory = settings.METRICS['DIRECTORY']
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(values) for key, values in _histograms.items()}
+        _next_flush = time.monotonic() + settings.METRICS['FLUSH_INTERVAL']
+    os.makedirs(directory, exist_ok=True)
+    write(os.path.join(directory, _file_name), counters, histograms)
+
+
+def maybe_flush():
+    if time.monotonic() >= _next_flush:
+        flush()
+
+
+def add_file(path, counters, histograms):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    for metric, labels, value in data['counters']:
+        key = (metric, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    for metric, labels, values in data['histograms']:
+        key = (metric, tuple(map(tuple, labels)))
+        if metric not in METRICS or len(values) != len(METRICS[metric][2]) + 2:
+            continue
+        total = histograms.setdefault(key, [0] * len(values))
+        for i, value in enumerate(values):
+            total[i] += value
+
+
+def worker_pid(name):
+    # metrics-<pid>-<random>.json, None for any other file
+    parts = name[:-len('.json')].split('-') if name.endswith('.json') else []
+    if len(parts) != 3 or parts[0] != 'metrics' or not parts[1].isdigit():
+        return None
+    return int(parts[1])
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge_exited(directory):
+    # folds the files of workers that are gone into MERGED; the lock keeps two
+    # scrapes from adding the same file twice
+    with open(os.path.join(directory, '.merge.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        exited = [name for name in os.listdir(directory)
+                  if worker_pid(name) is not None and not is_running(worker_pid(name))]
+        if not exited:
+            return
+        counters = {}
+        histograms = {}
+        for name in [MERGED] + exited:
+            add_file(os.path.join(directory, name), counters, histograms)
+        write(os.path.join(directory, MERGED), counters, histograms)
+        for name in exited:
+            os.remove(os.path.join(directory, name))
+
+
+def collect():
+    # values of every worker process added together
+    flush()
+    directory = settings.METRICS['DIRECTORY']
+    merge_exited(directory)
+    counters = {}
+    histograms = {}
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            add_file(os.path.join(directory, name), counters, histograms)
+    return counters, histograms
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for name, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def render():
+    # the Prometheus text exposition format
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            continue
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], values[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {values[-1]}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+# the number of queries run by the request the thread is handling, None
+# outside of requests
+_request = threading.local()
+
+
+def record_query(execute, sql, params, many, context):
+    queries = getattr(_request, 'queries', None)
+    if queries is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        _request.queries += 1
+        observe('db_query_duration_seconds', (), time.perf_counter() - start)
+
+
+def add_recorder(sender, connection, **kwargs):
+    # installed once per connection, rather than around every request
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(add_recorder)
+# connections opened before this module was loaded
+for connection in connections.all(initialized_only=True):
+    add_recorder(None, connection)
+
+
+class MetricsMiddleware:
+    # Records latency, database queries and throttling of every request, and
+    # writes this process's values to METRICS['DIRECTORY'] every
+    # FLUSH_INTERVAL seconds for the /metrics endpoint to add up.
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        _request.queries = 0
+        try:
+            response = self.get_response(request)
+            queries = _request.queries
+        finally:
+            _request.queries = None
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        route = '/' + match.route if match is not None else 'unmatched'
+        observe('http_request_duration_seconds',
+                (('route', route), ('method', request.method)), duration)
+        observe('db_queries_per_request', (('route', route),), queries)
+        if response.status_code == 429:
+            inc('throttled_requests_total', (('route', route),))
+        maybe_flush()
+        return response
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('LittleLemonAPI', '0004_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='orderitem',
+            unique_together=set(),
+        ),
+        # order used to point at the customer; keep it around as customer
+        # until 0006 has linked every item to one of that customer's orders
+        migrations.RenameField(
+            model_name='orderitem',
+            old_name='order',
+            new_name='customer',
+        ),
+        migrations.RenameField(
+            model_name='archivedorderitem',
+            old_name='order',
+            new_name='customer',
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='customer',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='archivedorderitem',
+            name='customer',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='LittleLemonAPI.order'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='order',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='LittleLemonAPI.archivedorder'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:05
+
+from django.db import migrations
+
+
+def link_items(item_model, order_model, db):
+    # Items only recorded the customer, so each one is attached to that
+    # customer's most recent order, and the orders that got more than one
+    # item this way are reported: their items may not add up to their total
+    # any more. Nothing is deleted; items that can't be attached (the
+    # customer has no order, or the order has that menu item already) keep
+    # their customer and an empty order.
+    latest = {}
+    for order_id, user_id in order_model.objects.using(db).order_by('date', 'id').values_list('id', 'user_id'):
+        latest[user_id] = order_id
+    taken = set(item_model.objects.using(db).filter(order__isnull=False).values_list('order_id', 'menuitem_id'))
+    attached = {}
+    unmatched = 0
+    for item_id, customer_id, menuitem_id in item_model.objects.using(db).filter(
+            order__isnull=True).order_by('id').values_list('id', 'customer_id', 'menuitem_id'):
+        order_id = latest.get(customer_id)
+        if order_id is None or (order_id, menuitem_id) in taken:
+            unmatched += 1
+            continue
+        taken.add((order_id, menuitem_id))
+        attached.setdefault(order_id, []).append(item_id)
+        item_model.objects.using(db).filter(pk=item_id).update(order_id=order_id, customer=None)
+
+    label = f"{item_model._meta.object_name} ({db})"
+    for order_id, item_ids in attached.items():
+        if len(item_ids) > 1:
+            print(f"\n  {label}: items {', '.join(map(str, item_ids))} were all attached to "
+                  f"order {order_id}, check that its total still matches them")
+    if unmatched:
+        print(f"\n  {label}: {unmatched} item(s) could not be attached to an order and were "
+              f"kept without one, with their customer")
+
+
+def link_orderitems(apps, schema_editor):
+    db = schema_editor.connection.alias
+    link_items(apps.get_model('LittleLemonAPI', 'OrderItem'),
+               apps.get_model('LittleLemonAPI', 'Order'), db)
+    link_items(apps.get_model('LittleLemonAPI', 'ArchivedOrderItem'),
+               apps.get_model('LittleLemonAPI', 'ArchivedOrder'), db)
+
+
+def unlink_orderitems(apps, schema_editor):
+    db = schema_editor.connection.alias
+    for item_model in (apps.get_model('LittleLemonAPI', 'OrderItem'),
+                       apps.get_model('LittleLemonAPI', 'ArchivedOrderItem')):
+        for item in item_model.objects.using(db).filter(order__isnull=False).select_related('order'):
+            item.customer_id = item.order.user_id
+            item.order = None
+            item.save(using=db, update_fields=['customer', 'order'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0005_orderitem_order'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_orderitems, unlink_orderitems),
+    ]
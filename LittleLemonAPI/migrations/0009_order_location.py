@@ -0,0 +1,81 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('LittleLemonAPI', '0008_menuitem_available_deletionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='location',
+            field=models.CharField(db_index=True, default='main', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='location',
+            field=models.CharField(db_index=True, default='main', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='location',
+            field=models.CharField(db_index=True, default='main', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='location',
+            field=models.CharField(db_index=True, default='main', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='location',
+            field=models.CharField(db_index=True, default='main', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='archivedorder',
+            name='delivery_crew',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_delivery_crew', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='archivedorder',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='archivedorderitem',
+            name='menuitem',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='LittleLemonAPI.menuitem'),
+        ),
+        migrations.AlterField(
+            model_name='cart',
+            name='menuitem',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='LittleLemonAPI.menuitem'),
+        ),
+        migrations.AlterField(
+            model_name='cart',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='delivery_crew',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='delivery_crew', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='menuitem',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='LittleLemonAPI.menuitem'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:21
+
+from django.conf import settings
+from django.db import migrations, models, connections
+import django.db.models.deletion
+
+
+def fill_summaries(apps, schema_editor):
+    # summaries of the orders placed before they were kept; the summary
+    # tables are only in the default database. Location databases not
+    # migrated yet hold no orders to count.
+    from LittleLemonAPI.routers import location_databases
+    from LittleLemonAPI.summary import rebuild
+
+    if schema_editor.connection.alias != 'default':
+        return
+    table = apps.get_model('LittleLemonAPI', 'Order')._meta.db_table
+    rebuild(apps=apps, databases=[
+        using for using in location_databases() if table in connections[using].introspection.table_names()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('LittleLemonAPI', '0009_order_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerOrderSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('order_count', models.IntegerField(default=0)),
+                ('total_spent', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('last_order_date', models.DateField(null=True)),
+                ('favorite_items', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CustomerItemCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=0)),
+                ('menuitem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='LittleLemonAPI.menuitem')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'menuitem')},
+            },
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
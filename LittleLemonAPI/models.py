@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 # Create your models here.
 
 
@@ -16,37 +18,149 @@ class MenuItem(models.Model):
     price = models.DecimalField(max_digits=6, decimal_places=2, db_index=True)
     featured = models.BooleanField(db_index=True)
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
+    # cleared as soon as the item is deleted, while LittleLemonAPI.deletion
+    # removes its carts and order items in the background
+    available = models.BooleanField(db_index=True, default=True)
 
     def __str__(self) -> str:
         return f"{self.title} ({self.category.title})"
 
 
+# Carts and orders are kept in the database of their restaurant location (see
+# LittleLemonAPI.routers), while users and menu items stay in the default
+# one, so their foreign keys to those can't be database constraints.
 class Cart(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, db_constraint=False)
     quantity = models.SmallIntegerField(default=1)
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
     price = models.DecimalField(max_digits=6, decimal_places=2)
+    location = models.CharField(
+        max_length=32, db_index=True, default=settings.DEFAULT_LOCATION)
 
     class Meta:
         unique_together = ('menuitem', 'user')
 
 
 class Order(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
     delivery_crew = models.ForeignKey(
-        User, on_delete=models.SET_NULL, related_name="delivery_crew", null=True)
+        User, on_delete=models.SET_NULL, related_name="delivery_crew", null=True, db_constraint=False)
     status = models.BooleanField(db_index=True, default=0)
     total = models.DecimalField(max_digits=6, decimal_places=2)
     date = models.DateField(db_index=True)
+    location = models.CharField(
+        max_length=32, db_index=True, default=settings.DEFAULT_LOCATION)
 
 
 class OrderItem(models.Model):
-    order = models.ForeignKey(User, on_delete=models.CASCADE)
-    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    # Only empty for items from before items belonged to an order that
+    # couldn't be attached to one of their customer's orders (see migration
+    # 0006); customer is only set on those.
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name="items", null=True)
+    customer = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="+", null=True, db_constraint=False)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, db_constraint=False)
     quantity = models.SmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
     price = models.DecimalField(max_digits=6, decimal_places=2)
+    location = models.CharField(
+        max_length=32, db_index=True, default=settings.DEFAULT_LOCATION)
 
     class Meta:
         unique_together = ('order', 'menuitem')
+
+
+# Cold storage for delivered orders moved out of the live tables by
+# LittleLemonAPI.archive. Primary keys are copied from the live rows so an
+# order keeps the same id once archived.
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    delivery_crew = models.ForeignKey(
+        User, on_delete=models.SET_NULL, related_name="archived_delivery_crew", null=True, db_constraint=False)
+    status = models.BooleanField(default=1)
+    total = models.DecimalField(max_digits=6, decimal_places=2)
+    date = models.DateField(db_index=True)
+    location = models.CharField(
+        max_length=32, db_index=True, default=settings.DEFAULT_LOCATION)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    # see OrderItem
+    order = models.ForeignKey(
+        ArchivedOrder, on_delete=models.CASCADE, related_name="items", null=True)
+    customer = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="+", null=True, db_constraint=False)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, db_constraint=False)
+    quantity = models.SmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    price = models.DecimalField(max_digits=6, decimal_places=2)
+    location = models.CharField(
+        max_length=32, db_index=True, default=settings.DEFAULT_LOCATION)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+
+# Stored outcome of a POST sent with an Idempotency-Key header, see
+# LittleLemonAPI.idempotency. status_code stays empty while the first
+# request carrying the key is still being processed.
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.SmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+
+# A menu item or user whose dependent rows are being removed in batches by
+# LittleLemonAPI.deletion. `deleted` counts the rows removed per table.
+class DeletionJob(models.Model):
+    MENU_ITEM = 'menuitem'
+    USER = 'user'
+    KINDS = [(MENU_ITEM, 'Menu item'), (USER, 'User')]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (RUNNING, 'Running'),
+                (DONE, 'Done'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=16, choices=KINDS)
+    object_id = models.BigIntegerField()
+    status = models.CharField(
+        max_length=16, choices=STATUSES, default=PENDING, db_index=True)
+    deleted = models.JSONField(default=dict)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+
+# Running totals of a customer's orders, live and archived, at every location.
+# Kept up to date by LittleLemonAPI.summary as orders and order items are
+# written; `python manage.py rebuild_order_summaries` recomputes them.
+class CustomerOrderSummary(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    order_count = models.IntegerField(default=0)
+    total_spent = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    last_order_date = models.DateField(null=True)
+    # [{"menuitem": id, "quantity": n}, ...] most ordered first, see ORDER_SUMMARY_FAVORITES
+    favorite_items = models.JSONField(default=list)
+
+
+# How many of a menu item a customer has ordered, to pick their favorite items
+class CustomerItemCount(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'menuitem')
@@ -39,12 +39,33 @@ from rest_framework import permissions
 from rest_framework.response import Response
 from rest_framework import status
 
+from . import metrics
+
+GROUP_CACHE_HIT = (('cache', 'group_names'), ('result', 'hit'))
+GROUP_CACHE_MISS = (('cache', 'group_names'), ('result', 'miss'))
+
+
+def in_group(user, name):
+    # The user's group names are loaded once per user object, so the several
+    # role checks of a request (or of all the sub-requests of a batch) share
+    # one query. Changes to the user's groups show up on the next request.
+    names = getattr(user, '_group_names', None)
+    if names is None:
+        metrics.inc('cache_requests_total', GROUP_CACHE_MISS)
+        names = frozenset(user.groups.values_list(
+            'name', flat=True)) if user.is_authenticated else frozenset()
+        user._group_names = names
+    else:
+        metrics.inc('cache_requests_total', GROUP_CACHE_HIT)
+    metrics.inc('group_checks_total', (('group', name),))
+    return name in names
+
 
 class IsManager(permissions.BasePermission):
     message = "You do not have permission to perform this action."
 
     def has_permission(self, request, view):
-        if request.user.groups.filter(name='Manager').exists():
+        if in_group(request.user, 'Manager'):
             return True
         else:
             return False
@@ -54,7 +75,7 @@ class IsDeliverer(permissions.BasePermission):
     message = "You do not have permission to perform this action."
 
     def has_permission(self, request, view):
-        if request.user.groups.filter(name='Deliverer').exists():
+        if in_group(request.user, 'Deliverer'):
             return True
         else:
             return False
@@ -64,7 +85,7 @@ class IsCustomer(permissions.BasePermission):
     message = "You do not have permission to perform this action."
 
     def has_permission(self, request, view):
-        if request.user.groups.filter(name='Customer').exists():
+        if in_group(request.user, 'Customer'):
             return True
         else:
             return False
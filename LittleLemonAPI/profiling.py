@@ -0,0 +1,143 @@
+import cProfile
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+
+HEADER = 'X-Profile'
+SALT = 'LittleLemonAPI.profiling'
+
+# Only one cProfile profiler can be active per process (from Python 3.12 a
+# second one raises ValueError), so overlapping requests take turns
+_profile_lock = threading.Lock()
+
+
+def profile_token():
+    # value for the X-Profile header, valid for PROFILING['TOKEN_MAX_AGE'] seconds
+    return signing.TimestampSigner(salt=SALT).sign('profile')
+
+
+def wants_profile(request):
+    token = request.headers.get(HEADER)
+    if token:
+        try:
+            signing.TimestampSigner(salt=SALT).unsign(
+                token, max_age=settings.PROFILING['TOKEN_MAX_AGE'])
+            return True
+        except signing.BadSignature:
+            pass
+    rate = settings.PROFILING['SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+
+def encode_route(method, route):
+    return f"{method} {route}".encode().hex()
+
+
+def decode_route(encoded):
+    return bytes.fromhex(encoded).decode()
+
+
+def save_profile(profiler, method, route):
+    # profiles are named <milliseconds>-<method and route>-<random>.prof so
+    # they can be grouped and aged without opening them
+    directory = settings.PROFILING['DIRECTORY']
+    os.makedirs(directory, exist_ok=True)
+    name = f"{int(time.time() * 1000)}-{encode_route(method, route)}-{uuid.uuid4().hex[:8]}.prof"
+    profiler.dump_stats(os.path.join(directory, name))
+
+    # keep only the newest MAX_FILES profiles
+    names = sorted(n for n in os.listdir(directory) if n.endswith('.prof'))
+    for old in names[:-settings.PROFILING['MAX_FILES']]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:
+            pass
+    return name
+
+
+class ProfilingMiddleware:
+    # Runs a request under cProfile when it carries a signed X-Profile header
+    # (see `python manage.py profile_token`) or is picked at
+    # PROFILING['SAMPLE_RATE']. Every other request only pays for the check.
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not wants_profile(request):
+            return self.get_response(request)
+        # another request is being profiled: serve this one without
+        if not _profile_lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # some other profiling tool (coverage, a debugger) is active
+            _profile_lock.release()
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+            _profile_lock.release()
+        match = request.resolver_match
+        route = match.route if match is not None else 'unresolved'
+        response['X-Profile-Id'] = save_profile(profiler, request.method, route)
+        return response
+
+
+def hotspots(window, limit):
+    # Top functions by cumulative time for every route profiled in the last
+    # `window` seconds, with the profiles of each route added together
+    directory = settings.PROFILING['DIRECTORY']
+    if not os.path.isdir(directory):
+        return []
+    cutoff = (time.time() - window) * 1000
+    routes = {}
+    for name in os.listdir(directory):
+        parts = name[:-len('.prof')].split('-') if name.endswith('.prof') else []
+        if len(parts) != 3 or not parts[0].isdigit() or int(parts[0]) < cutoff:
+            continue
+        try:
+            route = decode_route(parts[1])
+        except ValueError:
+            continue
+        routes.setdefault(route, []).append(os.path.join(directory, name))
+
+    report = []
+    for route, paths in sorted(routes.items()):
+        stats = None
+        loaded = 0
+        for path in paths:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(path)
+                else:
+                    stats.add(path)
+                loaded += 1
+            except (OSError, EOFError, TypeError, ValueError):
+                # removed by retention or still being written
+                continue
+        if stats is None:
+            continue
+        rows = sorted(stats.stats.items(),
+                      key=lambda row: row[1][3], reverse=True)[:limit]
+        report.append({
+            'route': route,
+            'profiles': loaded,
+            'hotspots': [{
+                'function': pstats.func_std_string(func),
+                'calls': calls,
+                'tottime': round(tottime, 6),
+                'cumtime': round(cumtime, 6),
+                'cumtime_per_request': round(cumtime / loaded, 6),
+            } for func, (primitive_calls, calls, tottime, cumtime, callers) in rows],
+        })
+    return report
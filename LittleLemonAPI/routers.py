@@ -0,0 +1,171 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import JsonResponse
+
+# Models kept in the database of their restaurant location. Everything else
+# (the menu, users, tokens...) lives in the default database.
+SHARDED_MODELS = {'cart', 'order', 'orderitem', 'archivedorder', 'archivedorderitem'}
+HEADER = 'X-Location'
+
+_current = threading.local()
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'LittleLemonAPI' and model._meta.model_name in SHARDED_MODELS
+
+
+def current_location():
+    return getattr(_current, 'location', settings.DEFAULT_LOCATION)
+
+
+def database_for(location):
+    return settings.LOCATIONS[location]
+
+
+def location_databases():
+    # every database holding location data, each once
+    return list(dict.fromkeys(settings.LOCATIONS.values()))
+
+
+def order_id_start(using):
+    # orders of the n-th location database are numbered from this + 1
+    return location_databases().index(using) * settings.ORDER_IDS_PER_LOCATION
+
+
+def location_of_order(pk):
+    # the location whose range of ids the order id is in; the current location
+    # for anything that can't be an order id
+    try:
+        index = (int(pk) - 1) // settings.ORDER_IDS_PER_LOCATION
+    except (TypeError, ValueError):
+        return current_location()
+    databases = location_databases()
+    if not 0 <= index < len(databases):
+        return current_location()
+    return next(location for location, using in settings.LOCATIONS.items()
+                if using == databases[index])
+
+
+def start_order_ids(using=DEFAULT_DB_ALIAS, **kwargs):
+    # post_migrate: moves the location database's order id sequence to the
+    # start of its range, unless it is past that already
+    from .models import Order
+
+    if using not in location_databases():
+        return
+    start = order_id_start(using)
+    if not start:
+        return
+    connection = connections[using]
+    table = Order._meta.db_table
+    if table not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # AUTOINCREMENT tables continue after the seq kept in sqlite_sequence
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, start])
+            elif row[0] < start:
+                cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [start, table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, 'id'), GREATEST(%s, "
+                f"(SELECT COALESCE(MAX(id), 0) FROM {connection.ops.quote_name(table)})))",
+                [table, start])
+        else:
+            raise ImproperlyConfigured(
+                f"Can't number the orders of location database {using} on {connection.vendor}")
+
+
+@contextmanager
+def use_location(location):
+    # queries on the sharded models without an explicit .using() go to this
+    # location's database
+    previous = getattr(_current, 'location', None)
+    _current.location = location
+    try:
+        yield
+    finally:
+        if previous is None:
+            del _current.location
+        else:
+            _current.location = previous
+
+
+def fan_out(function, databases=None):
+    # function(alias) for every location database at the same time; results
+    # come back in the order of LOCATIONS
+    databases = databases or location_databases()
+    if len(databases) == 1:
+        return [function(databases[0])]
+
+    def run(alias):
+        try:
+            return function(alias)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(databases)) as pool:
+        return list(pool.map(run, databases))
+
+
+class LocationRouter:
+    # Sends the sharded models to the database of the instance's location, or
+    # of the location of the current request (see LocationMiddleware), and
+    # everything else to the default database.
+    def db_for_read(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and is_sharded(type(instance)):
+            if instance._state.db:
+                return instance._state.db
+            if getattr(instance, 'location', None):
+                return database_for(instance.location)
+        return database_for(current_location())
+
+    def db_for_write(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and is_sharded(type(instance)):
+            if getattr(instance, 'location', None):
+                return database_for(instance.location)
+            if instance._state.db:
+                return instance._state.db
+        return database_for(current_location())
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # orders and carts refer to users and menu items in the default database
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS:
+            return True
+        if model_name is None:
+            return app_label == 'LittleLemonAPI'
+        return app_label == 'LittleLemonAPI' and model_name in SHARDED_MODELS
+
+
+class LocationMiddleware:
+    # Takes the restaurant location of a request from the X-Location header or
+    # ?location=, falling back to DEFAULT_LOCATION
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        location = request.headers.get(HEADER) or request.GET.get('location') \
+            or settings.DEFAULT_LOCATION
+        if location not in settings.LOCATIONS:
+            return JsonResponse({"message": f"Unknown location {location}"}, status=400)
+        with use_location(location):
+            return self.get_response(request)
@@ -1,8 +1,47 @@
 from rest_framework import serializers
-from .models import MenuItem, Category, Cart, Order, OrderItem
+from .models import MenuItem, Category, Cart, Order, OrderItem, CustomerOrderSummary
 from django.contrib.auth.models import User
 
 
+class DynamicFieldsMixin:
+    # Lets a view serialize only some fields, e.g.
+    # MenuItemSerializer(items, many=True, fields=['id', 'title'])
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+def requested_fields(query_params, serializer_class):
+    # Reads ?fields=id,title and/or ?exclude=featured from the query string.
+    # Returns the field names to serialize in declaration order, or None when
+    # neither parameter is given.
+    fields = query_params.get('fields')
+    exclude = query_params.get('exclude')
+    if not fields and not exclude:
+        return None
+    available = list(serializer_class().fields)
+    selected = [name.strip() for name in fields.split(',')] if fields else available
+    excluded = [name.strip() for name in exclude.split(',')] if exclude else []
+    unknown = [name for name in selected + excluded if name not in available]
+    if unknown:
+        raise serializers.ValidationError(
+            {'fields': [f"Unknown field(s): {', '.join(unknown)}. Available fields are: {', '.join(available)}"]})
+    return [name for name in available if name in selected and name not in excluded]
+
+
+def only_columns(serializer_class, fields):
+    # The model fields to pass to QuerySet.only() so that columns which are
+    # not serialized are never fetched
+    model = serializer_class.Meta.model
+    serializer_fields = serializer_class().fields
+    concrete = {field.name for field in model._meta.concrete_fields}
+    return [serializer_fields[name].source for name in fields
+            if serializer_fields[name].source in concrete]
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -18,7 +57,7 @@ class CategoryItemsSerializer(serializers.ModelSerializer):
         fields = ['title', 'id', 'slug']
 
 
-class MenuItemSerializer(serializers.ModelSerializer):
+class MenuItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     # category = serializers.SerializerMethodField()
 
     class Meta:
@@ -34,7 +73,7 @@ class MenuItemSerializer(serializers.ModelSerializer):
     #     return {'title': obj.category.title}
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     # user = UserSerializer(read_only=True)
     # menuitem = MenuItemSerializer(read_only=True)
 
@@ -42,12 +81,18 @@ class CartItemSerializer(serializers.ModelSerializer):
         model = Cart
         fields = ['user', 'menuitem',
                   'quantity', 'unit_price', 'price']
+        extra_kwargs = {
+            # deleted items can't be added while their carts are being cleared
+            'menuitem': {'queryset': MenuItem.objects.filter(available=True)},
+        }
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = ['id', 'user', 'delivery_crew', 'status', 'total', 'date']
+        fields = ['id', 'user', 'delivery_crew', 'status', 'total', 'date', 'location']
+        # set from the X-Location header or ?location= of the request
+        read_only_fields = ['location']
     # place the id attribute in case the customer has more than one order
 
 
@@ -55,6 +100,26 @@ class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ['order', 'menuitem', 'quantity', 'unit_price', 'price']
+        # only old items may be without an order
+        extra_kwargs = {'order': {'required': True, 'allow_null': False}}
+
+
+class OrderItemDetailSerializer(serializers.ModelSerializer):
+    # needs the menuitem prefetched, see views.orders_with_items
+    title = serializers.CharField(source='menuitem.title', read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = ['menuitem', 'title', 'quantity', 'unit_price', 'price']
+
+
+class OrderWithItemsSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    items = OrderItemDetailSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'user', 'delivery_crew',
+                  'status', 'total', 'date', 'location', 'items']
 
 
 class OrderStatusSerializer(serializers.ModelSerializer):
@@ -67,3 +132,21 @@ class OrderPutSerializer(serializers.ModelSerializer):
     class Meta():
         model = Order
         fields = ['delivery_crew']
+
+
+class OrderHistorySerializer(serializers.Serializer):
+    # rows come from archive.order_history() as dicts spanning live and archived orders
+    id = serializers.IntegerField()
+    user = serializers.IntegerField(source='user_id')
+    delivery_crew = serializers.IntegerField(source='delivery_crew_id')
+    status = serializers.BooleanField()
+    total = serializers.DecimalField(max_digits=6, decimal_places=2)
+    date = serializers.DateField()
+    location = serializers.CharField()
+    archived = serializers.BooleanField()
+
+
+class CustomerOrderSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerOrderSummary
+        fields = ['user', 'order_count', 'total_spent', 'last_order_date', 'favorite_items']
@@ -0,0 +1,52 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import menu_index, summary
+from .models import Category, MenuItem, Order, OrderItem
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def rebuild_menu_index(sender, **kwargs):
+    # wait for the commit, otherwise the index could be rebuilt from the old rows
+    transaction.on_commit(menu_index.invalidate)
+
+
+@receiver(post_init, sender=Order)
+def remember_order(sender, instance, **kwargs):
+    instance._summary_snapshot = summary.snapshot(instance, summary.ORDER_FIELDS)
+
+
+@receiver(post_init, sender=OrderItem)
+def remember_order_item(sender, instance, **kwargs):
+    instance._summary_snapshot = summary.snapshot(instance, summary.ORDER_ITEM_FIELDS)
+
+
+# keep the customers' order summaries up to date, see LittleLemonAPI.summary
+@receiver(post_save, sender=Order)
+def update_summary_for_order(sender, instance, created, raw=False, using=None, **kwargs):
+    if not raw and not summary.is_paused():
+        summary.apply_after_commit(summary.order_saved(instance, created), using)
+
+
+@receiver(post_delete, sender=Order)
+def update_summary_for_deleted_order(sender, instance, using=None, **kwargs):
+    if not summary.is_paused():
+        summary.apply_after_commit(summary.order_deleted(instance), using)
+
+
+@receiver(post_save, sender=OrderItem)
+def update_summary_for_order_item(sender, instance, created, raw=False, using=None, **kwargs):
+    if not raw and not summary.is_paused():
+        summary.apply_after_commit(summary.item_saved(instance, created), using)
+
+
+# before the delete, while the item's order is still there to tell whose it
+# was: deleting an order may remove the order before its items
+@receiver(pre_delete, sender=OrderItem)
+def update_summary_for_deleted_order_item(sender, instance, using=None, **kwargs):
+    if not summary.is_paused():
+        summary.apply_after_commit(summary.item_deleted(instance), using)
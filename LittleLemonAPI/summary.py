@@ -0,0 +1,258 @@
+import threading
+from contextlib import contextmanager
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import (Order, OrderItem, ArchivedOrder, CustomerOrderSummary,
+                     CustomerItemCount)
+from .routers import fan_out
+
+ORDER_FIELDS = ('user_id', 'total', 'date')
+ORDER_ITEM_FIELDS = ('order_id', 'menuitem_id', 'quantity')
+
+_state = threading.local()
+
+
+@contextmanager
+def paused():
+    # orders written or deleted inside don't change the summaries, for moving
+    # orders around (e.g. into the archive) without changing what was ordered
+    previous = getattr(_state, 'paused', False)
+    _state.paused = True
+    try:
+        yield
+    finally:
+        _state.paused = previous
+
+
+def is_paused():
+    return getattr(_state, 'paused', False)
+
+
+def snapshot(instance, fields):
+    # values as loaded or last saved, read from __dict__ so that fields left
+    # out with .only() are not fetched
+    return tuple(instance.__dict__.get(name) for name in fields)
+
+
+def create_or_update(model, lookup, created, changes):
+    # one UPDATE with F() expressions when the row exists, which is nearly
+    # always; concurrent writers never overwrite each other's increments
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **created)
+    except IntegrityError:
+        # created by a concurrent request in the meantime
+        model.objects.filter(**lookup).update(**changes)
+
+
+def add_orders(user_id, count, spent, date=None):
+    # count and spent are negative for orders taken away; the latest date can
+    # only move forward here, see forget_date for the other way
+    changes = {'order_count': F('order_count') + count,
+               'total_spent': F('total_spent') + spent}
+    if date is not None:
+        changes['last_order_date'] = Greatest(
+            Coalesce('last_order_date', Value(date)), Value(date))
+    create_or_update(CustomerOrderSummary, {'user_id': user_id},
+                     {'order_count': count, 'total_spent': spent, 'last_order_date': date}, changes)
+
+
+def latest_date(using, user_id):
+    dates = [model.objects.using(using).filter(user_id=user_id).aggregate(last=Max('date'))['last']
+             for model in (Order, ArchivedOrder)]
+    return max(filter(None, dates), default=None)
+
+
+def forget_date(user_id, date):
+    # an order dated `date` was removed or moved earlier; when it was the
+    # latest one, look the latest date up again in every location
+    if CustomerOrderSummary.objects.filter(pk=user_id, last_order_date=date).exists():
+        dates = fan_out(lambda using: latest_date(using, user_id))
+        CustomerOrderSummary.objects.filter(pk=user_id).update(
+            last_order_date=max(filter(None, dates), default=None))
+
+
+def add_items(user_id, menuitem_id, quantity):
+    if user_id is None:
+        # an old item without an order isn't counted anywhere
+        return
+    create_or_update(CustomerItemCount, {'user_id': user_id, 'menuitem_id': menuitem_id},
+                     {'quantity': quantity}, {'quantity': F('quantity') + quantity})
+    refresh_favorites(user_id)
+
+
+def move_items(items, old_user, user_id):
+    for menuitem_id, quantity in items:
+        add_items(old_user, menuitem_id, -quantity)
+        add_items(user_id, menuitem_id, quantity)
+
+
+def favorites(counts):
+    # counts: [(menuitem id, quantity)], most ordered first, ties by menu item
+    counts = sorted((c for c in counts if c[1] > 0), key=lambda c: (-c[1], c[0]))
+    return [{'menuitem': menuitem_id, 'quantity': quantity}
+            for menuitem_id, quantity in counts[:settings.ORDER_SUMMARY_FAVORITES]]
+
+
+def refresh_favorites(user_id):
+    counts = CustomerItemCount.objects.filter(user_id=user_id, quantity__gt=0) \
+        .order_by('-quantity', 'menuitem_id') \
+        .values_list('menuitem_id', 'quantity')[:settings.ORDER_SUMMARY_FAVORITES]
+    items = favorites(counts)
+    create_or_update(CustomerOrderSummary, {'user_id': user_id},
+                     {'favorite_items': items}, {'favorite_items': items})
+
+
+def order_saved(order, created):
+    old_user, old_total, old_date = order._summary_snapshot
+    user_id, total, date = snapshot(order, ORDER_FIELDS)
+    order._summary_snapshot = (user_id, total, date)
+    if created:
+        return [lambda: add_orders(user_id, 1, total, date)]
+    if old_user is None or (old_user, old_total, old_date) == (user_id, total, date):
+        return []
+    if old_user != user_id:
+        # the order and everything in it now belongs to another customer
+        items = list(OrderItem.objects.using(order._state.db).filter(
+            order_id=order.pk).values_list('menuitem_id', 'quantity'))
+        return [lambda: add_orders(old_user, -1, -old_total),
+                lambda: forget_date(old_user, old_date),
+                lambda: add_orders(user_id, 1, total, date),
+                lambda: move_items(items, old_user, user_id)]
+    updates = [lambda: add_orders(user_id, 0, total - old_total, date)]
+    if date < old_date:
+        updates.append(lambda: forget_date(user_id, old_date))
+    return updates
+
+
+def order_deleted(order):
+    user_id, total, date = order._summary_snapshot
+    if user_id is None:
+        return []
+    return [lambda: add_orders(user_id, -1, -total),
+            lambda: forget_date(user_id, date)]
+
+
+def order_user_id(order_id, item):
+    if order_id == item.order_id and OrderItem.order.is_cached(item):
+        return item.order.user_id
+    return Order.objects.using(item._state.db).filter(
+        pk=order_id).values_list('user_id', flat=True).first()
+
+
+def item_saved(item, created):
+    old_order, old_menuitem, old_quantity = item._summary_snapshot
+    order_id, menuitem_id, quantity = snapshot(item, ORDER_ITEM_FIELDS)
+    item._summary_snapshot = (order_id, menuitem_id, quantity)
+    user_id = order_user_id(order_id, item)
+    if created:
+        return [lambda: add_items(user_id, menuitem_id, quantity)]
+    if old_order is None or (old_order, old_menuitem, old_quantity) == (order_id, menuitem_id, quantity):
+        return []
+    if (old_order, old_menuitem) == (order_id, menuitem_id):
+        return [lambda: add_items(user_id, menuitem_id, quantity - old_quantity)]
+    old_user = order_user_id(old_order, item)
+    return [lambda: add_items(old_user, old_menuitem, -old_quantity),
+            lambda: add_items(user_id, menuitem_id, quantity)]
+
+
+def item_deleted(item):
+    order_id, menuitem_id, quantity = item._summary_snapshot
+    if order_id is None:
+        return []
+    user_id = order_user_id(order_id, item)
+    return [lambda: add_items(user_id, menuitem_id, -quantity)]
+
+
+def apply_after_commit(updates, using):
+    # the changes are worked out while the order is written, and only applied
+    # to the summaries once it is committed to the location's database
+    def apply():
+        for update in updates:
+            update()
+    if updates:
+        transaction.on_commit(apply, using=using)
+
+
+def collect_totals(using, apps):
+    # per customer totals of one location database, live and archived rows
+    # separately; rebuild adds them up
+    orders = []
+    items = []
+    for name in ('Order', 'ArchivedOrder'):
+        orders += apps.get_model('LittleLemonAPI', name).objects.using(using).values('user_id') \
+            .order_by().annotate(count=Count('id'), spent=Sum('total'), last=Max('date'))
+    for name in ('OrderItem', 'ArchivedOrderItem'):
+        items += apps.get_model('LittleLemonAPI', name).objects.using(using) \
+            .values('order__user_id', 'menuitem_id').order_by().annotate(quantity=Sum('quantity'))
+    return orders, items
+
+
+def rebuild(check=False, apps=global_apps, databases=None):
+    # Recomputes every summary and item tally from the orders and order items
+    # of every location (or of `databases`). Increments made while it runs
+    # are lost, so run it while no orders are being placed. Returns the number
+    # of customers whose summary or tallies were wrong; with check nothing is
+    # changed. apps is the migration's, when run from one.
+    item_count = apps.get_model('LittleLemonAPI', 'CustomerItemCount')
+    order_summary = apps.get_model('LittleLemonAPI', 'CustomerOrderSummary')
+    orders = {}
+    items = {}
+    for location_orders, location_items in fan_out(lambda using: collect_totals(using, apps), databases):
+        for row in location_orders:
+            total = orders.setdefault(row['user_id'], [0, 0, None])
+            total[0] += row['count']
+            total[1] += row['spent']
+            total[2] = max(filter(None, [total[2], row['last']]), default=None)
+        for row in location_items:
+            key = (row['order__user_id'], row['menuitem_id'])
+            items[key] = items.get(key, 0) + row['quantity']
+
+    users = set(apps.get_model('auth', 'User').objects.values_list('pk', flat=True))
+    menuitems = set(apps.get_model('LittleLemonAPI', 'MenuItem').objects.values_list('pk', flat=True))
+    counts = [item_count(user_id=user_id, menuitem_id=menuitem_id, quantity=quantity)
+              for (user_id, menuitem_id), quantity in items.items()
+              if user_id in users and menuitem_id in menuitems]
+    per_user = {}
+    for count in counts:
+        per_user.setdefault(count.user_id, {})[count.menuitem_id] = count.quantity
+    summaries = {
+        user_id: order_summary(
+            user_id=user_id, order_count=count, total_spent=spent, last_order_date=last,
+            favorite_items=favorites(per_user.get(user_id, {}).items()))
+        for user_id, (count, spent, last) in orders.items() if user_id in users}
+
+    stored = {s.user_id: s for s in order_summary.objects.all()}
+    stored_counts = {}
+    for user_id, menuitem_id, quantity in item_count.objects.values_list('user_id', 'menuitem_id', 'quantity'):
+        stored_counts.setdefault(user_id, {})[menuitem_id] = quantity
+    wrong = sum(1 for user_id in summaries.keys() | stored.keys() | per_user.keys() | stored_counts.keys()
+                if summary_values(summaries.get(user_id)) != summary_values(stored.get(user_id))
+                or tally(per_user.get(user_id)) != tally(stored_counts.get(user_id)))
+    if not check:
+        with transaction.atomic():
+            item_count.objects.all().delete()
+            order_summary.objects.all().delete()
+            item_count.objects.bulk_create(counts, batch_size=500)
+            order_summary.objects.bulk_create(summaries.values(), batch_size=500)
+    return wrong
+
+
+def tally(counts):
+    # a menu item counted zero times is the same as one never counted
+    return {menuitem_id: quantity for menuitem_id, quantity in (counts or {}).items() if quantity}
+
+
+def summary_values(summary):
+    # a customer without a summary is the same as one without orders
+    if summary is None:
+        return (0, 0, None, [])
+    return (summary.order_count, summary.total_spent,
+            summary.last_order_date, summary.favorite_items)
@@ -1,3 +1,407 @@
-from django.test import TestCase
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.db import connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import admission, deletion, metrics, summary
+from .archive import archive_orders
+from .routers import start_order_ids
+from .models import Cart, Category, IdempotencyKey, MenuItem, Order, OrderItem
+from .views import MenuItemsViewSet, OrderViewSet, OrderItemViewSet
 
 # Create your tests here.
+
+
+# a second location database for LocationTests, created by the test runner
+# like the default one
+connections.databases['location_test'] = {
+    **connections.databases['default'],
+    'NAME': os.path.join(tempfile.gettempdir(), 'littlelemon-test-downtown.sqlite3')}
+
+
+# keeps the requests of test runs out of the server's metrics
+TEST_METRICS = {**settings.METRICS,
+                'DIRECTORY': os.path.join(tempfile.gettempdir(), 'littlelemon-test-metrics')}
+
+
+@override_settings(METRICS=TEST_METRICS)
+@mock.patch.object(MenuItemsViewSet, 'throttle_classes', [])
+class MenuIndexTests(TestCase):
+    words = ['Greek', 'salad', 'Pasta', 'soup', 'Lemon', 'cake', 'ice',
+             'Cream', 'toast', 'TART', 'pie', 'chili', 'corn', 'a']
+
+    def setUp(self):
+        self.random = random.Random(31)
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.categories = [
+                Category.objects.create(slug=f'c{i}', title=title)
+                for i, title in enumerate(['Appetizer', 'Main', 'Dessert', 'Main'])]
+            for _ in range(60):
+                self.add_item()
+
+    def add_item(self):
+        return MenuItem.objects.create(
+            title=' '.join(self.random.choices(self.words, k=self.random.randint(1, 3))),
+            price=Decimal(self.random.randint(200, 900)) / 100,
+            featured=self.random.random() < 0.3,
+            category=self.random.choice(self.categories))
+
+    def random_params(self):
+        params = {}
+        if self.random.random() < 0.4:
+            params['category'] = self.random.choice(['Appetizer', 'Main', 'Dessert', 'Drinks'])
+        if self.random.random() < 0.4:
+            params['to_price'] = self.random.choice(['2', '4.5', '5.25', '9'])
+        if self.random.random() < 0.5:
+            params['search'] = ' '.join(self.random.choices(
+                ['sal', 'SOUP', 'cre', 'main', 'a', 'e', 'xyz', '"ice cream"', 'ta,pie'],
+                k=self.random.randint(1, 2)))
+        if self.random.random() < 0.6:
+            params['ordering'] = ','.join(self.random.choices(
+                ['price', '-price', 'category', '-category', 'title'],
+                k=self.random.randint(1, 2)))
+        if self.random.random() < 0.5:
+            params['fields'] = self.random.choice(['id,title,price', 'category,id'])
+        params['page'] = self.random.randint(1, 4)
+        return params
+
+    def get(self, params, enabled):
+        with override_settings(MENU_INDEX={**settings.MENU_INDEX, 'ENABLED': enabled}):
+            response = self.client.get('/api/menu-items/', params, HTTP_ACCEPT='application/json')
+        return response.status_code, response.json()
+
+    def test_index_matches_database(self):
+        for round in range(200):
+            params = self.random_params()
+            self.assertEqual(self.get(params, True), self.get(params, False), params)
+            if round % 20 == 0:
+                # the index has to follow changes to the menu
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.add_item()
+                    MenuItem.objects.filter(pk=self.random.choice(
+                        MenuItem.objects.values_list('pk', flat=True))).delete()
+                    category = self.random.choice(self.categories)
+                    category.title = self.random.choice(['Appetizer', 'Main', 'Dessert'])
+                    category.save()
+
+    def test_index_query_count(self):
+        self.get({}, True)
+        with self.assertNumQueries(0):
+            self.get({'category': 'Main', 'ordering': '-price', 'search': 'sal'}, True)
+
+
+@override_settings(DELETION={**settings.DELETION, 'BACKGROUND': False})
+class OrderSummaryTests(TestCase):
+    def setUp(self):
+        self.random = random.Random(37)
+        category = Category.objects.create(slug='main', title='Main')
+        self.users = [User.objects.create(username=f'customer{i}') for i in range(4)]
+        self.menuitems = [MenuItem.objects.create(title=f'Dish {i}', price=Decimal('4.00'),
+                                                  featured=False, category=category)
+                          for i in range(6)]
+
+    def random_date(self):
+        return date(2026, 1, 1) + timedelta(days=self.random.randint(0, 60))
+
+    def place_order(self):
+        order = Order.objects.create(
+            user=self.random.choice(self.users), total=Decimal(self.random.randint(1, 50)),
+            date=self.random_date(), status=self.random.random() < 0.5)
+        for menuitem in self.random.sample(self.menuitems, self.random.randint(1, 3)):
+            OrderItem.objects.create(order=order, menuitem=menuitem, quantity=self.random.randint(1, 4),
+                                     unit_price=menuitem.price, price=menuitem.price)
+
+    def change_order(self, order):
+        change = self.random.choice(['total', 'date', 'user', 'delete'])
+        if change == 'delete':
+            order.delete()
+            return
+        if change == 'total':
+            order.total = Decimal(self.random.randint(1, 50))
+        elif change == 'date':
+            order.date = self.random_date()
+        else:
+            order.user = self.random.choice(self.users)
+        order.save()
+
+    def change_item(self, item):
+        change = self.random.choice(['quantity', 'menuitem', 'delete'])
+        if change == 'delete':
+            item.delete()
+            return
+        if change == 'quantity':
+            item.quantity = self.random.randint(1, 4)
+        else:
+            taken = set(item.order.items.values_list('menuitem_id', flat=True))
+            choices = [m for m in self.menuitems if m.pk not in taken]
+            if not choices:
+                return
+            item.menuitem = self.random.choice(choices)
+        item.save()
+
+    def test_summaries_match_orders(self):
+        for round in range(150):
+            with self.captureOnCommitCallbacks(execute=True):
+                action = self.random.random()
+                orders = list(Order.objects.all())
+                items = list(OrderItem.objects.select_related('order'))
+                if action < 0.4 or not orders:
+                    self.place_order()
+                elif action < 0.65:
+                    self.change_order(self.random.choice(orders))
+                elif action < 0.9 and items:
+                    self.change_item(self.random.choice(items))
+                elif action < 0.97:
+                    archive_orders(days=(date.today() - date(2026, 1, 20)).days)
+                elif len(self.menuitems) > 3:
+                    # removed with plain SQL by the deletion job
+                    menuitem = self.menuitems.pop(self.random.randrange(len(self.menuitems)))
+                    deletion.delete_menu_item(menuitem)
+            deletion.process_jobs()
+            self.assertEqual(summary.rebuild(check=True), 0, round)
+
+
+@override_settings(METRICS=TEST_METRICS)
+class AdmissionTests(TestCase):
+    def saturated(self):
+        # the shipped classes, with every class but checkout taking all the
+        # slots it can get
+        conf = settings.ADMISSION_CONTROL
+        controller = admission.AdmissionController(
+            conf['MAX_CONCURRENT'],
+            [admission.PriorityClass(**{**cls, 'timeout': 0}) for cls in conf['CLASSES']],
+            admission.PriorityClass(**{**conf['DEFAULT'], 'timeout': 0}),
+            conf['EXEMPT'])
+        for name in ('default', 'browse', 'delivery'):
+            cls = next(c for c in controller.classes + [controller.default] if c.name == name)
+            while controller.acquire(cls):
+                pass
+        return controller
+
+    def test_checkout_gets_in_while_others_are_saturated(self):
+        controller = self.saturated()
+        browse = controller.classify('GET', '/api/menu-items/', True)
+        default = controller.classify('GET', '/api/orders/', False)
+        self.assertFalse(controller.acquire(browse))
+        self.assertFalse(controller.acquire(default))
+        checkout = controller.classify('POST', '/api/orders/', False)
+        self.assertEqual(checkout.name, 'checkout')
+        self.assertTrue(controller.acquire(checkout))
+
+    def test_metrics_are_not_queued(self):
+        with mock.patch.object(admission, 'get_controller', self.saturated):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+            self.assertEqual(self.client.get('/api/menu-items/').status_code, 503)
+
+
+@override_settings(METRICS=TEST_METRICS)
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='customer')
+        self.user.groups.add(Group.objects.create(name='Customer'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(slug='main', title='Main')
+        self.menuitem = MenuItem.objects.create(title='Soup', price=Decimal('4.00'),
+                                                featured=False, category=category)
+        self.payload = {'user': self.user.pk, 'menuitem': self.menuitem.pk, 'quantity': 1,
+                        'unit_price': '4.00', 'price': '4.00'}
+
+    def post(self, payload=None, key='key-1'):
+        return self.client.post('/api/cart/menu-items/', payload or self.payload,
+                                format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_gets_the_stored_response(self):
+        first = self.post()
+        retry = self.post()
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Cart.objects.count(), 1)
+        # the stored response is kept for the whole TTL
+        self.assertGreater(IdempotencyKey.objects.get().expires,
+                           timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_PROCESSING))
+
+    def test_key_reused_for_another_request(self):
+        self.post()
+        self.assertEqual(self.post({**self.payload, 'quantity': 2}).status_code, 422)
+
+    def test_retry_while_in_flight(self):
+        self.post()
+        IdempotencyKey.objects.update(status_code=None, response=None)
+        response = self.post()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_claim_expires_soon_while_in_flight(self):
+        claims = []
+        with mock.patch('LittleLemonAPI.views.CartItemSerializer.save',
+                        side_effect=lambda **kwargs: claims.append(IdempotencyKey.objects.get())):
+            self.post()
+        self.assertLessEqual(claims[0].expires,
+                             timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_PROCESSING))
+
+    def test_abandoned_claim_is_taken_over(self):
+        # the worker holding the key was killed before storing a response
+        self.post()
+        Cart.objects.all().delete()
+        IdempotencyKey.objects.update(status_code=None, response=None,
+                                      expires=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(Cart.objects.count(), 1)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
+
+    def test_late_response_leaves_the_new_claim_alone(self):
+        # the first request ran past its claim and a retry took the key over
+        # in the meantime; only the retry's outcome is stored
+        def taken_over(**kwargs):
+            claim = IdempotencyKey.objects.get()
+            claim.delete()
+            claim.pk = None
+            claim.save()
+
+        with mock.patch('LittleLemonAPI.views.CartItemSerializer.save', side_effect=taken_over):
+            self.post()
+        self.assertIsNone(IdempotencyKey.objects.get().status_code)
+
+
+@override_settings(METRICS=TEST_METRICS, LOCATIONS={'main': 'default', 'downtown': 'location_test'})
+@mock.patch.object(OrderViewSet, 'throttle_classes', [])
+@mock.patch.object(OrderItemViewSet, 'throttle_classes', [])
+class LocationTests(TransactionTestCase):
+    # fan_out reads the locations from threads, which don't see a TestCase's
+    # open transaction
+    databases = {'default', 'location_test'}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        start_order_ids('location_test')
+
+    def setUp(self):
+        self.customer = self.user('customer', 'Customer')
+        self.manager = self.user('manager', 'Manager')
+        self.deliverer = self.user('deliverer', 'Deliverer')
+
+    def user(self, name, group):
+        user = User.objects.create(username=name)
+        user.groups.add(Group.objects.get_or_create(name=group)[0])
+        return user
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def place_order(self, location):
+        response = self.client_for(self.customer).post(
+            '/api/orders/', {'user': self.customer.pk, 'total': '10.00', 'date': '2026-01-01'},
+            format='json', HTTP_X_LOCATION=location)
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def listed(self, user, **headers):
+        response = self.client_for(user).get('/api/orders/', **headers)
+        return sorted((order['id'], order['location']) for order in response.json())
+
+    def test_order_ids_come_from_the_location_range(self):
+        main = [self.place_order('main') for _ in range(2)]
+        downtown = [self.place_order('downtown') for _ in range(2)]
+        size = settings.ORDER_IDS_PER_LOCATION
+        self.assertTrue(all(0 < pk <= size for pk in main), main)
+        self.assertTrue(all(size < pk <= 2 * size for pk in downtown), downtown)
+        self.assertEqual(Order.objects.using('location_test').count(), 2)
+
+    def test_everyone_sees_their_orders_of_every_location(self):
+        main = self.place_order('main')
+        downtown = self.place_order('downtown')
+        expected = [(main, 'main'), (downtown, 'downtown')]
+        self.assertEqual(self.listed(self.customer), expected)
+        self.assertEqual(self.listed(self.customer, HTTP_X_LOCATION='downtown'), expected)
+        self.assertEqual(self.listed(self.manager), expected)
+
+        # assigned without saying which location the order is at
+        response = self.client_for(self.manager).patch(
+            '/api/orders/', {'id': downtown, 'user': self.customer.pk, 'total': '10.00',
+                             'date': '2026-01-01', 'delivery_crew': self.deliverer.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.using('location_test').get(pk=downtown).delivery_crew, self.deliverer)
+        self.assertEqual(self.listed(self.deliverer), [(downtown, 'downtown')])
+
+    def test_order_found_by_id_at_its_location(self):
+        downtown = self.place_order('downtown')
+        response = self.client_for(self.customer).get(f'/api/orders/{downtown}/?expand=items')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['location'], 'downtown')
+
+
+@mock.patch.dict(metrics._counters, clear=True)
+@mock.patch.dict(metrics._histograms, clear=True)
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(METRICS={**settings.METRICS, 'DIRECTORY': self.directory})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def exited_worker(self, counters):
+        # the file of a worker process that is gone
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        name = f'metrics-{process.pid}-abcdef12.json'
+        with open(os.path.join(self.directory, name), 'w') as f:
+            json.dump({'counters': counters, 'histograms': []}, f)
+        return name
+
+    def test_render(self):
+        metrics.inc('cache_requests_total', (('cache', 'say "hi"'), ('result', 'hit')), 2)
+        metrics.observe('db_queries_per_request', (('route', '/api/orders/'),), 3)
+        metrics.observe('db_queries_per_request', (('route', '/api/orders/'),), 60)
+        lines = metrics.render().splitlines()
+        self.assertIn('# TYPE cache_requests_total counter', lines)
+        self.assertIn('cache_requests_total{cache="say \\"hi\\"",result="hit"} 2', lines)
+        self.assertIn('db_queries_per_request_bucket{route="/api/orders/",le="2"} 0', lines)
+        self.assertIn('db_queries_per_request_bucket{route="/api/orders/",le="3"} 1', lines)
+        self.assertIn('db_queries_per_request_bucket{route="/api/orders/",le="+Inf"} 2', lines)
+        self.assertIn('db_queries_per_request_sum{route="/api/orders/"} 63', lines)
+        self.assertIn('db_queries_per_request_count{route="/api/orders/"} 2', lines)
+
+    def test_exited_workers_are_merged(self):
+        metrics.inc('group_checks_total', (('group', 'Manager'),))
+        first = self.exited_worker([['group_checks_total', [['group', 'Manager']], 5]])
+        self.assertIn('group_checks_total{group="Manager"} 6', metrics.render().splitlines())
+        self.assertNotIn(first, os.listdir(self.directory))
+        self.assertIn(metrics.MERGED, os.listdir(self.directory))
+
+        # counted once, and added to by the next worker to exit
+        self.exited_worker([['group_checks_total', [['group', 'Manager']], 1]])
+        self.assertIn('group_checks_total{group="Manager"} 7', metrics.render().splitlines())
+        self.assertIn('group_checks_total{group="Manager"} 7', metrics.render().splitlines())
+
+    def test_forked_worker_gets_its_own_file(self):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(write, metrics._file_name.encode())
+            os._exit(0)
+        os.close(write)
+        os.waitpid(pid, 0)
+        child = os.read(read, 200).decode()
+        os.close(read)
+        self.assertEqual(metrics.worker_pid(child), pid)
+        self.assertNotEqual(child, metrics._file_name)
@@ -12,11 +12,16 @@ urlpatterns = [
     path('categories/<int:pk>', views.SingleCategoryViewSet.as_view()),
     path('cart/menu-items/', views.CartItemViewSet.as_view()),
     path('orders/', views.OrderViewSet.as_view()),
+    path('orders/summary', views.order_summary),
     path('orders/<int:pk>/',
          views.OrderItemViewSet.as_view({'get': 'list', 'patch': 'update', 'put': 'update'})),
     path('api-token-auth/', obtain_auth_token),
     path('throttle-check', views.throttle_check),
     path('throttle-check-authenticated', views.throttle_check_authenticated),
+    path('profiles', views.profiles),
+    path('batch', views.batch),
+    path('admission', views.admission),
+    path('deletion-jobs/<int:pk>', views.deletion_job),
     path('groups/manager/users/', views.managers),
     path('groups/manager/users/<int:pk>', views.manager_manager_remove),
     path('groups/delivery-crew/users/', views.manager_delivery),
@@ -1,25 +1,111 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
-from .models import MenuItem, Category, Cart, Order, OrderItem
-from .serializers import MenuItemSerializer, CategoryItemsSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer, UserSerializer, OrderStatusSerializer, OrderPutSerializer
+from django.http import JsonResponse, HttpResponse, HttpResponseForbidden
+from .models import MenuItem, Category, Cart, Order, OrderItem, DeletionJob, CustomerOrderSummary
+from .serializers import MenuItemSerializer, CategoryItemsSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer, UserSerializer, OrderStatusSerializer, OrderPutSerializer, OrderHistorySerializer, OrderWithItemsSerializer, CustomerOrderSummarySerializer, requested_fields, only_columns
+from .archive import order_history
+from .idempotency import idempotent
+from .profiling import hotspots
+from .menu_index import get_index
+from .batch import BatchError, parse_batch, run_batch
+from .admission import get_controller
+from .deletion import delete_menu_item, delete_user, lease_cutoff, start_worker
+from .routers import current_location, fan_out, location_of_order, use_location
+from djoser.views import UserViewSet as DjoserUserViewSet
+from . import metrics as metrics_store
 from rest_framework import generics, viewsets, status
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import DecimalField
+from rest_framework.filters import OrderingFilter, SearchFilter
 from django.core.paginator import Paginator, EmptyPage
+from django.db.models import Prefetch
+from itertools import chain
+from django.conf import settings
 from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
 from rest_framework.permissions import IsAdminUser
 from django.contrib.auth.models import User, Group
-from .permissions import IsManager, IsCustomer, IsDeliverer
+from .permissions import IsManager, IsCustomer, IsDeliverer, in_group
+
+
+def to_price_param(request):
+    to_price = request.query_params.get('to_price')
+    if not to_price:
+        return None
+    try:
+        return DecimalField(max_digits=6, decimal_places=2).run_validation(to_price)
+    except ValidationError as exc:
+        raise ValidationError({'to_price': exc.detail})
+
+
+def orders_with_items(orders):
+    # three queries for any number of orders: the orders, all of their items,
+    # then the menu items those refer to. The menu items are fetched on their
+    # own rather than joined since they live in the default database, not in
+    # the location's (see routers.py)
+    return orders.prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.all()), 'items__menuitem')
 
 
 class MenuItemsViewSet(viewsets.ModelViewSet):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
-    queryset = MenuItem.objects.all().order_by('id')
+    queryset = MenuItem.objects.filter(available=True).order_by('id')
     serializer_class = MenuItemSerializer
     ordering_fields = ['price', 'category']
     search_fields = ['title', 'category__title']
 
+    sparse_fields = None
+
+    def list(self, request, *args, **kwargs):
+        # api/menu-items?fields=id,title,price only selects and returns those columns
+        self.sparse_fields = requested_fields(
+            request.query_params, MenuItemSerializer)
+        if settings.MENU_INDEX['ENABLED']:
+            return self.list_from_index(request)
+        return super().list(request, *args, **kwargs)
+
+    def list_from_index(self, request):
+        # same items in the same order as get_queryset/filter_queryset below,
+        # answered from the in-memory menu index instead of the database
+        rows = get_index().query(
+            category=request.query_params.get('category'),
+            to_price=to_price_param(request),
+            search_terms=SearchFilter().get_search_terms(request),
+            ordering=OrderingFilter().get_ordering(request, self.queryset, self))
+        page = self.paginate_queryset(rows)
+        fields = self.sparse_fields
+        data = [row.data if fields is None else {name: row.data[name] for name in fields}
+                for row in (rows if page is None else page)]
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # api/menu-items?category=Appetizer&to_price=5
+        category_name = self.request.query_params.get('category')
+        if category_name:
+            queryset = queryset.filter(category__title=category_name)
+        to_price = to_price_param(self.request)
+        if to_price is not None:
+            queryset = queryset.filter(price__lte=to_price)
+        if self.sparse_fields is not None:
+            queryset = queryset.only(
+                *only_columns(MenuItemSerializer, self.sparse_fields))
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        # break ties in ?ordering= by id so that pages never overlap
+        if 'id' not in queryset.query.order_by:
+            queryset = queryset.order_by(*queryset.query.order_by, 'id')
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.sparse_fields)
+        return super().get_serializer(*args, **kwargs)
+
     def get_permissions(self):
         permission_classes = []
         if self.request.method == 'POST':
@@ -29,7 +115,8 @@ class MenuItemsViewSet(viewsets.ModelViewSet):
     def get(self, request, *args, **kwargs):
         if (request.method == 'GET'):
             # example query strings - this is for api/menu-items?category=Appetizer
-            items = MenuItem.objects.select_related('category').all()
+            # the serializer only needs category_id, so no join to Category
+            items = MenuItem.objects.filter(available=True)
             category_name = request.query_params.get('category')
             to_price = request.query_params.get('to_price')
             search = request.query_params.get('search')
@@ -49,6 +136,10 @@ class MenuItemsViewSet(viewsets.ModelViewSet):
                 items = items.order_by(*ordering_fields)
                 # this is for api/menu-items?ordering=price,title (order by price as an example)
 
+            fields = requested_fields(request.query_params, MenuItemSerializer)
+            if fields is not None:
+                items = items.only(*only_columns(MenuItemSerializer, fields))
+
             paginator = Paginator(items, per_page=perpage)
             try:
                 items = paginator.page(number=page)
@@ -56,7 +147,7 @@ class MenuItemsViewSet(viewsets.ModelViewSet):
                 items = []
 
             # preparing response based on above code
-            serialized_item = MenuItemSerializer(items, many=True)
+            serialized_item = MenuItemSerializer(items, many=True, fields=fields)
             return Response(serialized_item.data)
 
     def post(self, request, *args, **kwargs):
@@ -67,7 +158,7 @@ class MenuItemsViewSet(viewsets.ModelViewSet):
 
 
 class SingleMenuItemViewSet(generics.RetrieveUpdateDestroyAPIView):
-    queryset = MenuItem.objects.all()
+    queryset = MenuItem.objects.filter(available=True)
     serializer_class = MenuItemSerializer
     permission_classes = [IsAuthenticated, IsManager]
 
@@ -76,13 +167,15 @@ class SingleMenuItemViewSet(generics.RetrieveUpdateDestroyAPIView):
         if not instance:
             return Response({"message": "This item doesn't exist"}, status=status.HTTP_404_NOT_FOUND)
         else:
-            instance.delete()
-            return Response({"message": "Item deleted successfully"}, status=status.HTTP_200_OK)
+            # the item disappears from the menu now; its carts and order items
+            # are removed in the background, see api/deletion-jobs/<job>
+            job = delete_menu_item(instance)
+            return Response({"message": "Item deleted successfully", "job": job.id}, status=status.HTTP_202_ACCEPTED)
 
     def update(self, request, *args, **kwargs):
         # 'pk' is the primary key parameter from the URL
         item_id = kwargs.get('pk')
-        if not MenuItem.objects.filter(pk=item_id).exists():
+        if not self.get_queryset().filter(pk=item_id).exists():
             return Response({"message": "This item doesn't exist"}, status=status.HTTP_404_NOT_FOUND)
         serialized_item = MenuItemSerializer(
             self.get_object(), data=request.data)
@@ -110,13 +203,17 @@ class CartItemViewSet(generics.RetrieveUpdateDestroyAPIView):
     def get(self, request):
         user = request.user
         carts = Cart.objects.filter(user=user)
-        serializer = CartItemSerializer(carts, many=True)
+        fields = requested_fields(request.query_params, CartItemSerializer)
+        if fields is not None:
+            carts = carts.only(*only_columns(CartItemSerializer, fields))
+        serializer = CartItemSerializer(carts, many=True, fields=fields)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @idempotent
     def post(self, request):
         serializer = CartItemSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            serializer.save(location=current_location())
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -145,22 +242,38 @@ class OrderViewSet(generics.ListCreateAPIView):
         # if request.user.groups.filter(name="Customer").exists():
         if IsCustomer().has_permission(request, self):
             orders = Order.objects.filter(user=user)
-            serializer = OrderSerializer(orders, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
         elif IsDeliverer().has_permission(request, self):
             orders = Order.objects.filter(delivery_crew_id=user)
-            serializer = OrderSerializer(orders, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
         elif IsManager().has_permission(request, self):
+            # api/orders?history=true also lists the archived orders
+            if request.query_params.get('history') in ('true', '1'):
+                serializer = OrderHistorySerializer(order_history(), many=True)
+                return Response(serializer.data, status=status.HTTP_200_OK)
             orders = Order.objects.all()
-            serializer = OrderSerializer(orders, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+        else:
+            return Response("You cannot view orders", status=status.HTTP_403_FORBIDDEN)
+
+        # api/orders?expand=items returns every order with its items nested
+        expand = request.query_params.get('expand') == 'items'
+        serializer_class = OrderWithItemsSerializer if expand else OrderSerializer
+        fields = requested_fields(request.query_params, serializer_class)
+        if fields is not None:
+            orders = orders.only(*only_columns(serializer_class, fields))
+        if expand and (fields is None or 'items' in fields):
+            orders = orders_with_items(orders)
+        # everyone sees their orders of every location, whichever location
+        # the request is for, read from all of their databases at the same time
+        orders = list(chain.from_iterable(
+            fan_out(lambda alias: list(orders.using(alias)))))
+        serializer = serializer_class(orders, many=True, fields=fields)
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @idempotent
     def post(self, request):
         if IsCustomer().has_permission(request, self):
             serializer = OrderSerializer(data=request.data)
             if serializer.is_valid():
-                serializer.save()
+                serializer.save(location=current_location())
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             else:
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -173,8 +286,10 @@ class OrderViewSet(generics.ListCreateAPIView):
         if IsManager().has_permission(request, self):
             if order_id is not None:
                 try:
-                    # Retrieve the order object based on the provided id
-                    order = Order.objects.get(id=order_id)
+                    # Retrieve the order object based on the provided id, from
+                    # the location it was placed at
+                    with use_location(location_of_order(order_id)):
+                        order = Order.objects.get(id=order_id)
                 except Order.DoesNotExist:
                     return Response(f"Order with id {order_id} does not exist", status=status.HTTP_404_NOT_FOUND)
 
@@ -196,8 +311,9 @@ class OrderViewSet(generics.ListCreateAPIView):
 
             if requested_order is not None:
                 try:
-                    order = Order.objects.get(
-                        delivery_crew_id=user, id=order_id)
+                    with use_location(location_of_order(order_id)):
+                        order = Order.objects.get(
+                            delivery_crew_id=user, id=order_id)
                 except Order.DoesNotExist:
                     return Response(f"Order with id {order_id} does not exist", status=status.HTTP_404_NOT_FOUND)
                 serializer = OrderStatusSerializer(
@@ -217,8 +333,10 @@ class OrderViewSet(generics.ListCreateAPIView):
             order_id = request.data.get('id')
             if order_id is not None:
                 try:
-                    # Retrieve the order object based on the provided id
-                    order = Order.objects.get(id=order_id)
+                    # Retrieve the order object based on the provided id, from
+                    # the location it was placed at
+                    with use_location(location_of_order(order_id)):
+                        order = Order.objects.get(id=order_id)
                 except Order.DoesNotExist:
                     return Response(f"Order with id {order_id} does not exist", status=status.HTTP_404_NOT_FOUND)
 
@@ -240,24 +358,34 @@ class OrderItemViewSet(viewsets.ModelViewSet):
     serializer_class = OrderItemSerializer
     permission_classes = [IsAuthenticated]
 
-    def get_queryset(self, *args, **kwargs):
+    def dispatch(self, request, *args, **kwargs):
+        # the order id tells which location's database the order is in
+        with use_location(location_of_order(kwargs.get('pk'))):
+            return super().dispatch(request, *args, **kwargs)
+
+    def get_orders(self):
+        # the pk in api/orders/<pk> is the order id
         user = self.request.user
-        pk = self.kwargs.get('pk')
-        if user.id == int(pk):
-            query = OrderItem.objects.filter(order_id=pk)
-            return query
-        elif user.groups.filter(name='Manager').exists():
-            return OrderItem.objects.all()
-        else:
-            return OrderItem.objects.none()
+        orders = Order.objects.filter(pk=self.kwargs.get('pk'))
+        if in_group(user, 'Manager'):
+            return orders
+        return orders.filter(user=user)
+
+    def get_queryset(self, *args, **kwargs):
+        return OrderItem.objects.filter(order__in=self.get_orders())
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        if queryset.exists():
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
+        # api/orders/<pk>?expand=items returns the order itself with its items nested
+        if request.query_params.get('expand') == 'items':
+            order = orders_with_items(self.get_orders()).first()
+            if order is not None:
+                return Response(OrderWithItemsSerializer(order).data)
         else:
-            return Response({"message": "You can't get other people's order items"}, status=status.HTTP_403_FORBIDDEN)
+            queryset = self.get_queryset()
+            if queryset.exists():
+                serializer = self.get_serializer(queryset, many=True)
+                return Response(serializer.data)
+        return Response({"message": "You can't get other people's order items"}, status=status.HTTP_403_FORBIDDEN)
 
     def put(self, request, *args, **kwargs):
         serialized_item = OrderPutSerializer(data=request.data)
@@ -271,7 +399,7 @@ class OrderItemViewSet(viewsets.ModelViewSet):
         return JsonResponse(status=201, data={'message': str(crew.username)+' was assigned to order #'+str(order.id)})
 
     def delete(self, request, *args, **kwargs):
-        if request.user.groups.filter(name='Manager').exists():
+        if in_group(request.user, 'Manager'):
             instance = self.get_object()
             if not instance:
                 return Response({"message": "This item doesn't exist"}, status=status.HTTP_404_NOT_FOUND)
@@ -282,6 +410,12 @@ class OrderItemViewSet(viewsets.ModelViewSet):
             return Response({"message": "You do not have permission to do this"}, status=status.HTTP_403_FORBIDDEN)
 
 
+class UserViewSet(DjoserUserViewSet):
+    # djoser's auth/users endpoints, with deletion done in the background
+    def perform_destroy(self, instance):
+        delete_user(instance)
+
+
 class CategoryItemsView(generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategoryItemsSerializer
@@ -308,6 +442,75 @@ def throttle_check(request):
 def throttle_check_authenticated(request):
     return Response({"message": "authenticated users throttle rate successful"})
 
+# /metrics in the Prometheus text format, for scrapers on ALLOWED_IPS
+def metrics(request):
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS['ALLOWED_IPS']:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics_store.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view()
+# order count, total spent, last order date and favorite items of the customer,
+# kept up to date as orders are placed so this is a single lookup however many
+# orders they have. Managers can ask for anyone with ?user=<id>
+@permission_classes([IsAuthenticated])
+def order_summary(request):
+    user_id = request.user.pk
+    if 'user' in request.query_params:
+        if not in_group(request.user, 'Manager'):
+            return Response({"message": "You can only see your own summary"}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            user_id = int(request.query_params['user'])
+        except ValueError:
+            return Response({"message": "user must be a user id"}, status=status.HTTP_400_BAD_REQUEST)
+    summary = CustomerOrderSummary.objects.filter(pk=user_id).first()
+    if summary is None:
+        # no orders yet
+        summary = CustomerOrderSummary(user_id=user_id)
+    return Response(CustomerOrderSummarySerializer(summary).data)
+
+
+@api_view()
+# progress of a menu item or user deletion
+@permission_classes([IsAuthenticated, IsManager])
+def deletion_job(request, pk):
+    job = get_object_or_404(DeletionJob, pk=pk)
+    if job.status == DeletionJob.RUNNING and job.updated < lease_cutoff():
+        # the process running it went away, let this one take it over
+        start_worker()
+    return Response({"id": job.id, "kind": job.kind, "object_id": job.object_id, "status": job.status,
+                     "deleted": job.deleted, "error": job.error, "created": job.created, "updated": job.updated})
+
+
+@api_view()
+# staff only - requests running and queued per priority class, and how many were shed
+@permission_classes([IsAdminUser])
+def admission(request):
+    return Response(get_controller().snapshot())
+
+
+@api_view(['POST'])
+# runs several api requests in one round trip, see batch.parse_batch for the payload
+@permission_classes([IsAuthenticated])
+def batch(request):
+    try:
+        sub_requests, parallel = parse_batch(request.data)
+    except BatchError as exc:
+        return Response({"message": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"responses": run_batch(request, sub_requests, parallel)})
+
+
+@api_view()
+# staff only - api/profiles?window=3600&limit=20 summarises the profiles taken in the last hour
+@permission_classes([IsAdminUser])
+def profiles(request):
+    try:
+        window = int(request.query_params.get('window', 3600))
+        limit = int(request.query_params.get('limit', 20))
+    except ValueError:
+        return Response({"message": "window and limit must be whole numbers"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(hotspots(window, limit))
+
 # must keep which enables managers to add users to a manager groups
 # /api/groups/manager/users endpoint
 
@@ -48,6 +48,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'LittleLemonAPI.metrics.MetricsMiddleware',
+    'LittleLemonAPI.profiling.ProfilingMiddleware',
+    'LittleLemonAPI.admission.AdmissionControlMiddleware',
+    'LittleLemonAPI.routers.LocationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +92,27 @@ DATABASES = {
     }
 }
 
+# Restaurant locations and the database each one's carts and orders are kept
+# in; the menu, users and everything else stay in the default database (see
+# LittleLemonAPI/routers.py). Requests pick their location with an X-Location
+# header or ?location=, and go to DEFAULT_LOCATION without one.
+# Every location in EXTRA_LOCATIONS gets its own file, db_<location>.sqlite3,
+# whose tables are created with `python manage.py migrate --database location_<location>`
+DEFAULT_LOCATION = 'main'
+EXTRA_LOCATIONS = []  # e.g. ['downtown', 'airport']
+LOCATIONS = {DEFAULT_LOCATION: 'default'}
+for location in EXTRA_LOCATIONS:
+    DATABASES[f'location_{location}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db_{location}.sqlite3',
+    }
+    LOCATIONS[location] = f'location_{location}'
+DATABASE_ROUTERS = ['LittleLemonAPI.routers.LocationRouter']
+# Order ids are unique across locations: the n-th location database (the
+# default one first, then EXTRA_LOCATIONS in order) numbers its orders from
+# n * ORDER_IDS_PER_LOCATION + 1, so only ever add locations at the end
+ORDER_IDS_PER_LOCATION = 10 ** 12
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -162,6 +187,105 @@ DJOSER = {
     }
 }
 
+# Delivered orders older than this are moved to the archive tables by
+# `python manage.py archive_orders`, in transactions of ORDER_ARCHIVE_BATCH_SIZE orders
+ORDER_ARCHIVE_AFTER_DAYS = 90
+ORDER_ARCHIVE_BATCH_SIZE = 500
+
+# How long (in seconds) the response to a POST sent with an Idempotency-Key
+# header is replayed for retries of that request
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+# How long a key is held for a request that is still running. A retry after
+# that takes the key over, so keep it above the worker timeout (e.g. gunicorn's
+# --timeout)
+IDEMPOTENCY_KEY_PROCESSING = 60
+
+# Requests are profiled with cProfile when they carry a signed X-Profile header
+# (`python manage.py profile_token`) or, at random, at SAMPLE_RATE (0 to 1).
+# The newest MAX_FILES profiles are kept in DIRECTORY and summarised at api/profiles
+PROFILING = {
+    'SAMPLE_RATE': 0,
+    'DIRECTORY': BASE_DIR / 'profiles',
+    'MAX_FILES': 500,
+    'TOKEN_MAX_AGE': 60 * 60,
+}
+
+# api/menu-items is answered from an in-memory copy of the menu, rebuilt when a
+# menu item or category changes. Every worker process learns about a change
+# through a version number in CACHE, which must be shared by all of them (so
+# not the local memory cache); MAX_AGE is only a safety net
+MENU_INDEX = {
+    'ENABLED': True,
+    'MAX_AGE': 60,
+    'CACHE': 'menu_index',
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'menu_index': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'menu_index',
+    },
+}
+
+# api/batch accepts up to MAX_REQUESTS sub-requests and runs read requests on
+# up to MAX_WORKERS threads when asked to run them in parallel
+BATCH = {
+    'MAX_REQUESTS': 20,
+    'MAX_WORKERS': 4,
+}
+
+# At most MAX_CONCURRENT requests are handled at once per process. Each request
+# gets the first class it matches (or DEFAULT); a class may use at most `limit`
+# of the slots and waits up to `timeout` seconds for one, lower `priority`
+# first, before it is turned away with a 503. The `reserve` slots of a class
+# are kept free of lower priority classes. EXEMPT paths (monitoring and staff
+# pages) are never queued. Counts are shown at api/admission
+ADMISSION_CONTROL = {
+    'ENABLED': True,
+    'MAX_CONCURRENT': 16,
+    'RETRY_AFTER': 1,
+    'EXEMPT': [r'^/metrics$', r'^/api/admission$', r'^/api/profiles$', r'^/admin/'],
+    'CLASSES': [
+        # placing orders and filling carts
+        {'name': 'checkout', 'priority': 0, 'limit': 16, 'timeout': 5, 'reserve': 4,
+         'methods': ['POST', 'DELETE'], 'paths': [r'^/api/orders/$', r'^/api/cart/']},
+        # assigning and delivering orders
+        {'name': 'delivery', 'priority': 1, 'limit': 12, 'timeout': 3, 'reserve': 2,
+         'methods': ['PATCH', 'PUT'], 'paths': [r'^/api/orders/']},
+        # browsing the menu without logging in
+        {'name': 'browse', 'priority': 3, 'limit': 6, 'timeout': 0.5,
+         'methods': ['GET', 'HEAD'], 'anonymous': True},
+    ],
+    'DEFAULT': {'name': 'default', 'priority': 2, 'limit': 12, 'timeout': 2},
+}
+
+# Every worker process writes its metrics to DIRECTORY at most once per
+# FLUSH_INTERVAL seconds; /metrics adds them up for Prometheus and only answers
+# requests from ALLOWED_IPS
+METRICS = {
+    'DIRECTORY': BASE_DIR / 'metrics',
+    'FLUSH_INTERVAL': 1,
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+}
+
+# Deleted menu items and users are hidden at once; their carts, orders and order
+# items are then removed BATCH_SIZE rows at a time, pausing PAUSE seconds between
+# batches. With BACKGROUND off, run `python manage.py process_deletions` instead.
+# A running job that hasn't finished a batch in LEASE seconds is taken over by
+# another worker, as its process has probably died
+DELETION = {
+    'BATCH_SIZE': 500,
+    'PAUSE': 0.05,
+    'BACKGROUND': True,
+    'LEASE': 60,
+}
+
+# How many of a customer's most ordered menu items api/orders/summary lists
+ORDER_SUMMARY_FAVORITES = 3
+
 # SIMPLE_JWT = {
 #     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
 
@@ -1,11 +1,19 @@
 from django.contrib import admin
 from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+from LittleLemonAPI import views
+
+# replaces the users endpoints of djoser.urls below, see views.UserViewSet
+users_router = DefaultRouter()
+users_router.register('users', views.UserViewSet)
 # from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView, TokenBlacklistView
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('LittleLemonAPI.urls')),
+    path('metrics', views.metrics),
+    path('auth/', include(users_router.urls)),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
     # path('api/token', TokenObtainPairView.as_view(), name='token_obtain_pair'),